@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the external model and image APIs, for load testing the bridge server offline.
+
+Endpoints (OpenAI-compatible shapes):
+- POST /v1/chat/completions     -> segmentation JSON for the v1, v2 (sentence-indexed) and hybrid
+                                   (boundary) prompts of story_segmenter.py; honours "stream": true (SSE)
+- POST /v1/images/generations   -> { data: [{ url }] } pointing at /files/<id>.png on this server
+- GET  /files/<id>.png          -> a valid PNG of roughly --payload-bytes bytes
+- GET  /stats                   -> request / error counters
+
+Latency, jitter, error rate and payload size are configurable, so the bridge server's pools
+and timeouts can be sized without calling api.openai.com or api.siliconflow.cn.
+
+Run:
+  python fake_upstream.py --port 9100 --latency-ms 800 --jitter-ms 200 --error-rate 0.02
+Then point the bridge at it, e.g. apiUrl=http://127.0.0.1:9100/v1/chat/completions and
+imageApiUrl=http://127.0.0.1:9100/v1/images/generations (load_test.py --fake does this).
+"""
+import os
+import re
+import json
+import time
+import zlib
+import random
+import struct
+import argparse
+import threading
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeConfig:
+    def __init__(self, latency_ms: float = 500, jitter_ms: float = 100, image_latency_ms: float = 2000,
+                 error_rate: float = 0.0, payload_bytes: int = 200_000, summary_chars: int = 20,
+                 stream_chunk_chars: int = 8):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.image_latency_ms = image_latency_ms
+        self.error_rate = error_rate
+        self.payload_bytes = payload_bytes
+        self.summary_chars = summary_chars
+        self.stream_chunk_chars = stream_chunk_chars
+
+
+def make_png(approx_bytes: int) -> bytes:
+    """A valid RGB PNG of roughly approx_bytes bytes (random pixels barely compress)."""
+    side = max(1, int((max(approx_bytes, 64) / 3) ** 0.5))
+    rng = random.Random(0)
+    raw = b''.join(b'\x00' + bytes(rng.getrandbits(8) for _ in range(side * 3)) for _ in range(side))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 1))
+            + chunk(b'IEND', b''))
+
+
+# ---------- canned model answers ----------
+
+def _filler(prefix: str, n: int) -> str:
+    return (prefix + '，' + '画面描述' * n)[:max(len(prefix), n)]
+
+
+def _density(prompt: str) -> float:
+    # the last mention is the actual input; the v1 template also shows example values earlier
+    found = re.findall(r'density["=:\s]*([0-9.]+)', prompt)
+    try:
+        return float(found[-1]) if found else 0.5
+    except ValueError:
+        return 0.5
+
+
+def answer_for_prompt(prompt: str, cfg: FakeConfig) -> dict:
+    """Build a plausible answer for whichever story_segmenter prompt protocol was sent."""
+    density = _density(prompt)
+    boundary_ids = [int(x) for x in re.findall(r'^\[B(\d+)\]', prompt, re.M)]
+    if boundary_ids:  # hybrid boundary judgement
+        return {'b': [{'id': i, 'cut': 1 if i % 3 == 0 else 0} for i in boundary_ids]}
+
+    sentence_ids = re.findall(r'^\[(\d+)\] ', prompt, re.M)
+    if sentence_ids:  # v2 sentence-indexed
+        n = len(sentence_ids)
+        k = max(1, int(n * (0.1 + 0.4 * density)))
+        step = max(1, n // k)
+        return {
+            'segments': [{'s': s, 't': 'scene', 'c': _filler(f'场景{j}', cfg.summary_chars)}
+                         for j, s in enumerate(range(0, n, step))],
+            'twists': [{'i': n // 2, 'c': '但是'}] if n > 2 else []
+        }
+
+    # v1: the text is embedded as {"text": ..., "density": ...} at the end of the prompt
+    text_len = 1000
+    idx = prompt.rfind('"text":')
+    if idx != -1:
+        try:
+            text_len = len(json.loads(prompt[prompt.rfind('{', 0, idx):])['text'])
+        except ValueError:
+            pass
+    k = max(1, int(text_len / 200 * (0.5 + density)))
+    size = max(1, text_len // k)
+    segments = []
+    for j, start in enumerate(range(0, text_len, size)):
+        segments.append({
+            'id': j + 1, 'type': 'scene', 'start_char': start, 'end_char': min(text_len, start + size) - 1,
+            'summary': _filler(f'场景{j}', cfg.summary_chars), 'cues': ['随后']
+        })
+    return {'segments': segments, 'twists': []}
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeUpstream/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    # ----- helpers -----
+    @property
+    def cfg(self) -> FakeConfig:
+        return self.server.cfg
+
+    def _count(self, key: str):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + 1
+
+    def _sleep(self, base_ms: float):
+        delay = max(0.0, random.gauss(base_ms, self.cfg.jitter_ms)) / 1000.0
+        time.sleep(delay)
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _maybe_fail(self, kind: str) -> bool:
+        if self.cfg.error_rate > 0 and random.random() < self.cfg.error_rate:
+            status = random.choice((429, 500, 503))
+            self._count(f'{kind}_error_{status}')
+            self._send_json(status, {'error': {'message': 'injected failure', 'type': 'fake_upstream'}},
+                            {'Retry-After': '1'} if status != 500 else None)
+            return True
+        return False
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return {}
+
+    # ----- routes -----
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        body = self._read_json()
+        if path.endswith('/chat/completions'):
+            self._count('chat')
+            if self._maybe_fail('chat'):
+                return
+            self._chat(body)
+        elif path.endswith('/images/generations'):
+            self._count('image')
+            self._sleep(self.cfg.image_latency_ms)
+            if self._maybe_fail('image'):
+                return
+            host = self.headers.get('Host') or f'127.0.0.1:{self.server.server_port}'
+            self._send_json(200, {'data': [{'url': f'http://{host}/files/{uuid.uuid4().hex}.png'}]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path.startswith('/files/'):
+            self._count('file')
+            data = self.server.png
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path == '/stats':
+            with self.server.stats_lock:
+                self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _chat(self, body: dict):
+        messages = body.get('messages') or []
+        prompt = messages[-1].get('content', '') if messages else ''
+        content = json.dumps(answer_for_prompt(prompt, self.cfg), ensure_ascii=False)
+        if not body.get('stream'):
+            self._sleep(self.cfg.latency_ms)
+            self._send_json(200, {
+                'id': 'fake-' + uuid.uuid4().hex[:8], 'object': 'chat.completion', 'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}]
+            })
+            return
+
+        # stream: first token after ~20% of the latency, the rest spread over the remainder
+        self._sleep(self.cfg.latency_ms * 0.2)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        step = max(1, self.cfg.stream_chunk_chars)
+        pieces = [content[i:i + step] for i in range(0, len(content), step)]
+        per_piece = self.cfg.latency_ms * 0.8 / 1000.0 / max(1, len(pieces))
+        try:
+            for piece in pieces:
+                event = {'choices': [{'index': 0, 'delta': {'content': piece}}]}
+                self.wfile.write(('data: ' + json.dumps(event, ensure_ascii=False) + '\n\n').encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(per_piece)
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+def make_server(host: str = '127.0.0.1', port: int = 9100, cfg: FakeConfig = None) -> ThreadingHTTPServer:
+    srv = ThreadingHTTPServer((host, port), FakeUpstreamHandler)
+    srv.daemon_threads = True
+    srv.cfg = cfg or FakeConfig()
+    srv.png = make_png(srv.cfg.payload_bytes)
+    srv.stats = {}
+    srv.stats_lock = threading.Lock()
+    return srv
+
+
+def start_in_thread(host: str = '127.0.0.1', port: int = 0, cfg: FakeConfig = None) -> ThreadingHTTPServer:
+    """Start a fake upstream on a background thread (port 0 picks a free port)."""
+    srv = make_server(host, port, cfg)
+    threading.Thread(target=srv.serve_forever, name='fake-upstream', daemon=True).start()
+    return srv
+
+
+def add_config_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--latency-ms', type=float, default=float(os.environ.get('FAKE_LATENCY_MS', 500)),
+                        help='mean chat completion latency')
+    parser.add_argument('--jitter-ms', type=float, default=float(os.environ.get('FAKE_JITTER_MS', 100)),
+                        help='std deviation added to every latency')
+    parser.add_argument('--image-latency-ms', type=float, default=float(os.environ.get('FAKE_IMAGE_LATENCY_MS', 2000)),
+                        help='mean image generation latency')
+    parser.add_argument('--error-rate', type=float, default=float(os.environ.get('FAKE_ERROR_RATE', 0)),
+                        help='fraction of requests answered with 429/500/503')
+    parser.add_argument('--payload-bytes', type=int, default=int(os.environ.get('FAKE_PAYLOAD_BYTES', 200_000)),
+                        help='approximate size of generated images')
+    parser.add_argument('--summary-chars', type=int, default=20, help='length of generated summaries/cues')
+
+
+def config_from_args(args) -> FakeConfig:
+    return FakeConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, image_latency_ms=args.image_latency_ms,
+                      error_rate=args.error_rate, payload_bytes=args.payload_bytes, summary_chars=args.summary_chars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake OpenAI-compatible chat and image endpoints for load testing.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    add_config_args(parser)
+    args = parser.parse_args()
+    srv = make_server(args.host, args.port, config_from_args(args))
+    print(f'fake upstream listening on http://{args.host}:{srv.server_port}')
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
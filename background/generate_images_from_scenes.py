@@ -1,5 +1,8 @@
 import os
+import re
 import json
+import random
+import hashlib
 import requests
 import shutil
 from pathlib import Path
@@ -11,6 +14,7 @@ API_KEY = os.getenv('IMAGE_API_KEY', "sk-gyxfthqwngqqnfaghtrnnhtrhdumjjqlkgmipqh
 MODEL = os.getenv('IMAGE_MODEL', "Qwen/Qwen-Image")      # 可选: Qwen/Qwen-Image, Kwai-Kolors/Kolors 等
 OUTPUT_DIR = os.getenv('IMAGE_OUTPUT_DIR', "generated_images")
 IMAGE_SIZE = os.getenv('IMAGE_SIZE', "1024x1024")       # 推荐分辨率，可改为 "1472x1140" (4:3)
+DEDUP_THRESHOLD = float(os.getenv('IMAGE_DEDUP_THRESHOLD', "0.7"))  # 场景摘要相似度 >= 该值时复用前面场景的图片
 # ===================================
 
 def create_prompt(scene_text: str, scene_summary: str) -> str:
@@ -24,23 +28,25 @@ def create_prompt(scene_text: str, scene_summary: str) -> str:
     return base_prompt
 
 
-def generate_image(prompt: str, index: int):
+def generate_image(prompt: str, index: int, output_dir: str = None, api_url: str = None, api_key: str = None,
+                   model: str = None, image_size: str = None, timeout: float = None):
     """
     调用 API 生成图片并保存
+    未传入的参数使用文件顶部的配置（可被环境变量覆盖）
     """
     headers = {
-        "Authorization": f"Bearer {API_KEY}",
+        "Authorization": f"Bearer {api_key or API_KEY}",
         "Content-Type": "application/json"
     }
 
     data = {
-        "model": MODEL,
+        "model": model or MODEL,
         "prompt": prompt,
-        "image_size": IMAGE_SIZE
+        "image_size": image_size or IMAGE_SIZE
     }
 
     print(f"[{index}] 生成图像中... prompt: {prompt}")
-    response = requests.post(API_URL, headers=headers, json=data)
+    response = requests.post(api_url or API_URL, headers=headers, json=data, timeout=timeout)
 
     if response.status_code != 200:
         print(f"❌ API 错误 ({response.status_code}): {response.text}")
@@ -51,8 +57,8 @@ def generate_image(prompt: str, index: int):
     image_url = resp_json["data"][0]["url"]
 
     # 下载图片
-    img_data = requests.get(image_url).content
-    filename = os.path.join(OUTPUT_DIR, f"scene_{index:03d}.png")
+    img_data = requests.get(image_url, timeout=timeout).content
+    filename = os.path.join(output_dir or OUTPUT_DIR, f"scene_{index:03d}.png")
     with open(filename, "wb") as f:
         f.write(img_data)
 
@@ -60,7 +66,82 @@ def generate_image(prompt: str, index: int):
     return filename
 
 
-def main(input_path: str):
+# ---------- 近重复场景检测 ----------
+_MERSENNE_PRIME = (1 << 61) - 1
+_PUNCT_RE = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def shingles(text: str, k: int = 2) -> set:
+    """去掉空白和标点后取长度为 k 的字符片段（中文摘要较短，2 字片段区分度更好）"""
+    norm = _PUNCT_RE.sub('', text or '').lower()
+    if len(norm) <= k:
+        return {norm} if norm else set()
+    return {norm[i:i + k] for i in range(len(norm) - k + 1)}
+
+
+class SceneDeduplicator:
+    """
+    用 MinHash 估计场景摘要之间的 Jaccard 相似度，找出与之前已生成场景近乎相同的场景。
+    - threshold: 相似度阈值，>= 阈值视为重复
+    - num_perm: MinHash 签名长度，越长估计越准
+    """
+
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, num_perm: int = 64, k: int = 2):
+        self.threshold = threshold
+        self.k = k
+        rng = random.Random(1)  # 固定种子，保证多次运行结果一致
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+        self._seen = []  # [(index, signature)]
+
+    def signature(self, text: str):
+        hashes = [int.from_bytes(hashlib.blake2b(sh.encode('utf-8'), digest_size=8).digest(), 'little')
+                  for sh in shingles(text, self.k)]
+        if not hashes:
+            return None
+        return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms)
+
+    def match(self, text: str):
+        """返回 (最相似的已登记场景编号, 相似度)，没有达到阈值的返回 None"""
+        sig = self.signature(text)
+        if sig is None:
+            return None
+        best = None
+        for index, other in self._seen:
+            sim = sum(1 for x, y in zip(sig, other) if x == y) / len(sig)
+            if sim >= self.threshold and (best is None or sim > best[1]):
+                best = (index, sim)
+        return best
+
+    def add(self, index: int, text: str) -> None:
+        """登记一个真正生成了图片的场景"""
+        sig = self.signature(text)
+        if sig is not None:
+            self._seen.append((index, sig))
+
+
+def reuse_image(source: str, index: int, output_dir: str = None) -> str:
+    """把已生成的图片复制为 scene_###.png，便于 insert_images_into_md 按编号查找"""
+    filename = os.path.join(output_dir or OUTPUT_DIR, f"scene_{index:03d}.png")
+    if os.path.abspath(source) != os.path.abspath(filename):
+        shutil.copyfile(source, filename)
+    return filename
+
+
+def write_manifest(entries, output_dir: str = None, threshold: float = None) -> str:
+    """写出 manifest.json，记录每个场景的图片以及复用关系"""
+    path = os.path.join(output_dir or OUTPUT_DIR, "manifest.json")
+    manifest = {
+        "dedup_threshold": threshold,
+        "generated": sum(1 for e in entries if e.get("file") and e.get("reused_from") is None),
+        "reused": sum(1 for e in entries if e.get("reused_from") is not None),
+        "scenes": entries,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def main(input_path: str, dedup_threshold: float = DEDUP_THRESHOLD):
     # Path(OUTPUT_DIR).mkdir(exist_ok=True)
     if os.path.exists(OUTPUT_DIR):
         print(f"🗑️ 检测到已有文件夹 {OUTPUT_DIR}，正在删除旧文件...")
@@ -72,19 +153,44 @@ def main(input_path: str):
         data = json.load(f)
 
     scenes = data.get("segments", [])
+    # dedup_threshold 为 None 时关闭去重
+    dedup = SceneDeduplicator(dedup_threshold) if dedup_threshold is not None else None
+    files = {}
+    entries = []
     for i, scene in enumerate(scenes):
         if scene.get("type") != "scene":
             continue
-        prompt = create_prompt(scene["text"], scene["summary"])
-        generate_image(prompt, i)
+        summary = scene.get("summary", "")
+        prompt = create_prompt(scene.get("text", ""), summary)
+        entry = {"index": i, "prompt": prompt, "file": None, "reused_from": None}
+        dup = dedup.match(summary) if dedup else None
+        if dup and files.get(dup[0]):
+            entry["file"] = reuse_image(files[dup[0]], i)
+            entry["reused_from"] = dup[0]
+            entry["similarity"] = round(dup[1], 3)
+            print(f"[{i}] 与场景 {dup[0]} 近似（相似度 {dup[1]:.2f}），复用其图片 -> {entry['file']}")
+        else:
+            entry["file"] = generate_image(prompt, i)
+            if entry["file"] and dedup:
+                dedup.add(i, summary)
+        if entry["file"]:
+            files[i] = entry["file"]
+        entries.append(entry)
+
+    manifest_path = write_manifest(entries, threshold=dedup_threshold)
+    reused = sum(1 for e in entries if e["reused_from"] is not None)
+    print(f"🧾 已写出清单 {manifest_path}（复用 {reused} 张，节省 {reused} 次图像 API 调用）")
 
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Generate images for story scenes.")
     parser.add_argument("--segments", required=True, help="Path to scene JSON file.")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="Reuse an earlier scene's image when summary similarity >= this value (default %(default)s).")
+    parser.add_argument("--no-dedup", action="store_true", help="Generate an image for every scene.")
     args = parser.parse_args()
-    main(args.segments)
+    main(args.segments, dedup_threshold=None if args.no_dedup else args.dedup_threshold)
 
 
 # python generate_images_from_scenes.py --segments input_story.txt.json
@@ -45,6 +45,23 @@ def make_rel_path(target_path, base_dir):
     return rel.replace(os.path.sep, '/')
 
 
+def marker_to_markdown(original_marker, num, found, output_dir, copy_images=False):
+    """把单个 {seg xxx} 标记渲染为 Markdown；found 为图片路径，None 表示未找到"""
+    if not found:
+        return f"{original_marker}\n\n<!-- ⚠️ 未找到对应图片 scene_{num}.png -->\n"
+    if copy_images:
+        img_outdir = os.path.join(output_dir, 'images')
+        os.makedirs(img_outdir, exist_ok=True)
+        dest_name = os.path.basename(found)
+        dest_path = os.path.join(img_outdir, dest_name)
+        if os.path.abspath(found) != os.path.abspath(dest_path):
+            shutil.copy2(found, dest_path)
+        rel = make_rel_path(dest_path, output_dir)
+        return f"<!-- {original_marker} -->\n\n![]({rel})\n"
+    rel = make_rel_path(found, output_dir)
+    return f"<!-- {original_marker} -->\n\n![]({rel})\n"
+
+
 def process_text(content, output_dir, copy_images=False):
     """替换 {seg xxx} 标记为 Markdown 图片语法"""
     not_found = []
@@ -52,22 +69,9 @@ def process_text(content, output_dir, copy_images=False):
     def repl(m):
         num = m.group(1)
         found = find_image_for_number(num)
-        original_marker = m.group(0)
         if not found:
             not_found.append(num)
-            return f"{original_marker}\n\n<!-- ⚠️ 未找到对应图片 scene_{num}.png -->\n"
-        if copy_images:
-            img_outdir = os.path.join(output_dir, 'images')
-            os.makedirs(img_outdir, exist_ok=True)
-            dest_name = os.path.basename(found)
-            dest_path = os.path.join(img_outdir, dest_name)
-            if os.path.abspath(found) != os.path.abspath(dest_path):
-                shutil.copy2(found, dest_path)
-            rel = make_rel_path(dest_path, output_dir)
-            return f"<!-- {original_marker} -->\n\n![]({rel})\n"
-        else:
-            rel = make_rel_path(found, output_dir)
-            return f"<!-- {original_marker} -->\n\n![]({rel})\n"
+        return marker_to_markdown(m.group(0), num, found, output_dir, copy_images=copy_images)
 
     new_content = SEG_RE.sub(repl, content)
     return new_content, not_found
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Load generator for the bridge server (server.py).
+
+Drives /analyze and /generate_image at one or more concurrency levels and reports, per level:
+requests, throughput, error rate (by status), and p50/p95/p99/max latency.
+
+A 200 that carries a degraded result counts as an error, under status "200-fallback": the
+simulated /generate_image placeholder, the server's single-segment /analyze fallback
+(result.fallback) and hybrid results whose model calls failed (result.hybrid.ai_errors).
+With a fake upstream, each level also reports the fake's own error counters for that level.
+
+With --fake the AI and image parameters in every request point at fake_upstream.py, so the
+real code paths (segmenter subprocess, model call, image generator subprocess) run without
+touching external APIs. --start-fake and --start-server run both in-process for a one-command
+offline / CI run.
+
+Examples:
+  # everything in one process, fake upstream with 300 ms model latency
+  python load_test.py --start-server --start-fake --latency-ms 300 --endpoint analyze --mode ai --concurrency 1,4,16 --requests 40
+
+  # against an already running server and fake upstream
+  python load_test.py --server http://127.0.0.1:8000 --fake http://127.0.0.1:9100 --endpoint generate_image --concurrency 2,8
+"""
+import sys
+import json
+import time
+import math
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import requests
+
+ROOT = Path(__file__).resolve().parent
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(math.ceil(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def build_payload(endpoint: str, i: int, args, text: str, fake: Optional[str]) -> Dict[str, Any]:
+    if endpoint == 'analyze':
+        # a unique suffix per request keeps single-flight from collapsing the load
+        body = {'text': text if args.same_text else f'{text}\n\n（请求 {i}）', 'mode': args.mode, 'density': args.density}
+        if fake:
+            body.update({'apiUrl': f'{fake}/v1/chat/completions', 'apiKey': 'fake-key'})
+        if args.prompt_version:
+            body['promptVersion'] = args.prompt_version
+        return body
+    body = {'prompt': f'load test scene {i}, cinematic lighting'}
+    if fake:
+        body.update({'imageApiUrl': f'{fake}/v1/images/generations', 'imageApiKey': 'fake-key'})
+    return body
+
+
+def is_fallback(endpoint: str, body: Dict[str, Any]) -> bool:
+    """True when a 200 response carries a degraded result instead of a real one."""
+    if body.get('simulated'):
+        return True
+    if endpoint != 'analyze':
+        return False
+    result = body.get('result') or {}
+    return bool(result.get('fallback') or (result.get('hybrid') or {}).get('ai_errors'))
+
+
+def fake_stats(fake: Optional[str]) -> Dict[str, int]:
+    if not fake:
+        return {}
+    try:
+        return requests.get(f'{fake}/stats', timeout=5).json()
+    except Exception:
+        return {}
+
+
+def run_level(server: str, endpoint: str, concurrency: int, total: int, args, text: str, fake: Optional[str]) -> Dict[str, Any]:
+    url = f'{server}/{endpoint}'
+    local = threading.local()
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    lock = threading.Lock()
+    upstream_before = fake_stats(fake)
+
+    def one(i: int) -> None:
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            resp = session.post(url, json=build_payload(endpoint, i, args, text, fake), timeout=args.timeout)
+            status = str(resp.status_code)
+            if resp.status_code == 200 and is_fallback(endpoint, resp.json()):
+                status = '200-fallback'
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] += 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - wall_start
+
+    latencies.sort()
+    ok = statuses.get('200', 0)
+    upstream_after = fake_stats(fake)
+    upstream = {k: v - upstream_before.get(k, 0) for k, v in upstream_after.items() if v - upstream_before.get(k, 0)}
+
+    def ms(v: Optional[float]) -> Optional[float]:
+        return None if v is None else round(v * 1000, 1)
+
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': total,
+        'ok': ok,
+        'error_rate': round(1 - ok / total, 4) if total else 0.0,
+        'statuses': dict(statuses),
+        'fallbacks': statuses.get('200-fallback', 0),
+        'upstream': upstream,
+        'throughput_rps': round(total / wall, 2) if wall > 0 else None,
+        'wall_seconds': round(wall, 3),
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def start_bridge_server():
+    """Run server.APP on a free port in a background thread; returns its base URL."""
+    from werkzeug.serving import make_server
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    import server
+    srv = make_server('127.0.0.1', 0, server.APP, threaded=True)
+    threading.Thread(target=srv.serve_forever, name='bridge-server', daemon=True).start()
+    return f'http://127.0.0.1:{srv.server_port}'
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    print(f"{'endpoint':<15}{'conc':>5}{'reqs':>6}{'rps':>9}{'err%':>7}{'fb':>5}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'maxms':>9}  statuses")
+    for r in rows:
+        lat = r['latency_ms']
+        print(f"{r['endpoint']:<15}{r['concurrency']:>5}{r['requests']:>6}{r['throughput_rps'] or 0:>9.2f}"
+              f"{r['error_rate'] * 100:>7.1f}{r['fallbacks']:>5}"
+              f"{lat['p50'] or 0:>9.1f}{lat['p95'] or 0:>9.1f}{lat['p99'] or 0:>9.1f}{lat['max'] or 0:>9.1f}  "
+              f"{json.dumps(r['statuses'])}" + (f"  upstream {json.dumps(r['upstream'])}" if r['upstream'] else ''))
+
+
+def main():
+    import fake_upstream
+
+    parser = argparse.ArgumentParser(description='Load test the bridge server /analyze and /generate_image endpoints.')
+    parser.add_argument('--server', default='http://127.0.0.1:8000', help='bridge server base URL')
+    parser.add_argument('--start-server', action='store_true', help='run the bridge server in-process on a free port')
+    parser.add_argument('--fake', default=None, help='fake upstream base URL to point AI/image parameters at')
+    parser.add_argument('--start-fake', action='store_true', help='run fake_upstream in-process on a free port')
+    parser.add_argument('--endpoint', choices=['analyze', 'generate_image'], action='append',
+                        help='endpoint(s) to drive (repeatable; default analyze)')
+    parser.add_argument('--mode', choices=['heuristic', 'ai', 'hybrid'], default='heuristic', help='/analyze mode')
+    parser.add_argument('--prompt-version', default=None, help='/analyze prompt_version (v1 / v2)')
+    parser.add_argument('--density', type=float, default=0.5)
+    parser.add_argument('--text', default=str(ROOT / 'input_story.txt'), help='story text file for /analyze')
+    parser.add_argument('--same-text', action='store_true', help='send identical text (exercises single-flight)')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=50, help='requests per concurrency level')
+    parser.add_argument('--timeout', type=float, default=180, help='per-request client timeout (seconds)')
+    parser.add_argument('--json', default=None, help='also write the report to this JSON file')
+    fake_upstream.add_config_args(parser)
+    args = parser.parse_args()
+
+    fake = args.fake
+    fake_srv = None
+    if args.start_fake:
+        fake_srv = fake_upstream.start_in_thread(cfg=fake_upstream.config_from_args(args))
+        fake = f'http://127.0.0.1:{fake_srv.server_port}'
+        print(f'fake upstream: {fake}')
+    server = start_bridge_server() if args.start_server else args.server.rstrip('/')
+    if args.start_server:
+        print(f'bridge server: {server}')
+
+    text = Path(args.text).read_text(encoding='utf-8')
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    rows = []
+    for endpoint in args.endpoint or ['analyze']:
+        for level in levels:
+            rows.append(run_level(server, endpoint, level, args.requests, args, text, fake))
+            print_table(rows[-1:])
+
+    report = {'server': server, 'fake': fake, 'mode': args.mode, 'results': rows}
+    try:
+        report['admission'] = requests.get(f'{server}/admission', timeout=5).json()
+    except Exception:
+        pass
+    if fake_srv is not None:
+        report['fake_stats'] = dict(fake_srv.stats)
+
+    print()
+    print_table(rows)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f'report written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,11 @@ Simple local bridge server to expose backend tools to the frontend during develo
 
 Endpoints:
 - GET /health -> 200 OK
-- POST /analyze -> { text, mode='heuristic', density=0.5 } -> returns JSON of segmentation/analysis
+- POST /analyze -> { text, mode='heuristic'|'ai'|'hybrid', density=0.5 } -> returns JSON of segmentation/analysis
 - POST /generate_image -> { prompt } -> attempts to run image generator (if configured) or returns simulated result
+- POST /pipeline -> { text, mode, density, ...ai/image params } -> segments, generates images and assembles Markdown in one job
+- GET /works, GET /works/<id>, GET /works/<id>/segments -> stored works (see work_store.py); pass save=true to /analyze or /pipeline to store results
+- GET /admission -> concurrency / queue depth per admission pool (segment, ai, image)
 
 Run:
   python server.py
@@ -15,17 +18,422 @@ Requirements: flask, requests
 import os
 import sys
 import json
+import uuid
+import hashlib
 import tempfile
+import math
+import time
+import threading
 import subprocess
+from contextlib import contextmanager
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory, abort
+from flask import Flask, request, jsonify, send_file, abort
 from flask_cors import CORS
+from werkzeug.utils import safe_join
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None  # Pillow is only needed for resized image variants
 
 ROOT = Path(__file__).resolve().parent
 APP = Flask(__name__)
 # enable CORS so web frontends (running on different origin) can call this bridge during dev
 CORS(APP)
 
+# how long a request waits for an identical in-flight analysis before giving up (seconds)
+ANALYZE_WAIT_TIMEOUT = float(os.environ.get('ANALYZE_WAIT_TIMEOUT', 90))
+
+
+class _InFlightCall:
+    """State shared between the leader of a computation and the requests waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SharedCallError(RuntimeError):
+    """Raised in a waiter when the leader's call failed; the leader's exception is __cause__.
+    Each waiter gets its own instance so threads never share (and rewrite) one traceback.
+    """
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into a single execution.
+
+    The first caller for a key (the leader) runs the function; callers arriving while it is
+    still running block until it finishes and receive the same result, or a SharedCallError
+    wrapping the leader's exception.
+    Nothing is cached: once the leader finishes, the next call with that key runs again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, timeout=None):
+        """Run fn() once per key. Returns (result, shared) where shared is True for waiters.
+        Waiters raise TimeoutError if the leader does not finish within timeout seconds.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+
+        if not leader:
+            try:
+                finished = call.done.wait(timeout)
+            finally:
+                with self._lock:
+                    call.waiters -= 1
+            if not finished:
+                raise TimeoutError('timed out waiting for identical in-flight request')
+            if call.error is not None:
+                raise SharedCallError(f'identical in-flight request failed: {call.error}') from call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return {'calls': len(self._calls), 'waiters': sum(c.waiters for c in self._calls.values())}
+
+
+ANALYZE_FLIGHTS = SingleFlight()
+
+
+def analyze_flight_key(text: str, mode: str, density: float, ai_kwargs: dict = None) -> str:
+    """Build the single-flight key for an /analyze request from the parameters that affect its result.
+    The api key is hashed so it never sits in memory as part of a key.
+    """
+    params = {'mode': mode, 'density': float(density)}
+    for k, v in (ai_kwargs or {}).items():
+        if k == 'api_key':
+            v = hashlib.sha256(str(v).encode('utf-8')).hexdigest()
+        params[k] = v
+    h = hashlib.sha256(text.encode('utf-8'))
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+class Overloaded(Exception):
+    """Raised when an admission pool cannot take more work; rendered as 429/503 with Retry-After."""
+
+    def __init__(self, pool: str, status: int, retry_after: int, reason: str):
+        super().__init__(f'{pool} pool {reason}')
+        self.pool = pool
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionPool:
+    """Concurrency limit for one class of outbound work, with a bounded FIFO wait queue.
+
+    Up to `limit` callers run at once and up to `max_queue` more wait, each for at most
+    `max_wait` seconds. A full queue is rejected immediately with 429; a caller that waits
+    too long gets 503. Both carry a Retry-After estimated from recent hold times.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._avg_hold = 1.0  # EWMA of seconds a slot is held
+
+    def retry_after(self) -> int:
+        # time for the current queue plus one more caller to drain through the slots
+        return max(1, int(math.ceil(self._avg_hold * (self.waiting + 1) / self.limit)))
+
+    def acquire(self, count: int = 1):
+        """Take `count` permits at once (a job that runs several upstream calls in parallel)."""
+        count = max(1, min(int(count), self.limit))
+        with self._cond:
+            # newcomers queue behind existing waiters so admission stays FIFO-ish
+            if self.active + count <= self.limit and self.waiting == 0:
+                self.active += count
+                self.admitted += 1
+                return
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded(self.name, 429, self.retry_after(), 'queue full')
+            self.waiting += 1
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self.active + count > self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise Overloaded(self.name, 503, self.retry_after(), 'timed out waiting for a slot')
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += count
+            self.admitted += 1
+
+    def release(self, held: float, count: int = 1):
+        count = max(1, min(int(count), self.limit))
+        with self._cond:
+            self.active -= count
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held
+            # waiters may need different permit counts, so wake them all to re-check
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'active': self.active,
+                'waiting': self.waiting,
+                'max_queue': self.max_queue,
+                'max_wait': self.max_wait,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_hold_seconds': round(self._avg_hold, 3),
+            }
+
+
+def _admission_pool(name: str, limit: int, max_wait: float) -> AdmissionPool:
+    """Build a pool configured by ADMIT_<NAME>_LIMIT / _QUEUE / _WAIT environment variables."""
+    prefix = f'ADMIT_{name.upper()}_'
+    limit = int(os.environ.get(prefix + 'LIMIT', limit))
+    return AdmissionPool(
+        name,
+        limit=limit,
+        max_queue=int(os.environ.get(prefix + 'QUEUE', limit * 4)),
+        max_wait=float(os.environ.get(prefix + 'WAIT', max_wait)),
+    )
+
+
+# segment: local heuristic segmenter subprocesses (CPU bound)
+# ai: segmentation that calls the language model (ai / hybrid modes)
+# image: image generation subprocesses
+ADMISSION = {
+    'segment': _admission_pool('segment', os.cpu_count() or 2, 10),
+    'ai': _admission_pool('ai', 4, 20),
+    'image': _admission_pool('image', 2, 30),
+}
+
+
+def analyze_pool(mode: str) -> AdmissionPool:
+    return ADMISSION['segment'] if mode == 'heuristic' else ADMISSION['ai']
+
+# resized image variants served by /static/generated_images/<name>?w=&fmt=&q=
+IMAGE_VARIANT_DIR = Path(os.environ.get('IMAGE_VARIANT_DIR', str(ROOT / '.image_variants')))
+IMAGE_VARIANT_MAX_BYTES = int(os.environ.get('IMAGE_VARIANT_MAX_BYTES', 256 * 1024 * 1024))
+IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', 300))
+# requested widths are rounded up to one of these so clients cannot fill the cache with one-off sizes
+IMAGE_VARIANT_WIDTHS = (64, 128, 256, 384, 512, 768, 1024, 1536, 2048)
+IMAGE_VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+class ImageVariantCache:
+    """On-disk cache of resized/re-encoded copies of generated images.
+
+    Variants are keyed by the sha256 of the source file, so regenerating scene_000.png
+    produces new variants instead of serving stale ones. Total size is bounded by
+    max_bytes; least recently used variants (by mtime, refreshed on every hit) are evicted first.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._hashes = {}
+
+    def source_hash(self, path: str) -> str:
+        """sha256 of the source file, memoised on (mtime, size)."""
+        st = os.stat(path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        with self._lock:
+            self._hashes[path] = (stamp, digest)
+        return digest
+
+    def open(self, path: str, digest: str, width: int, fmt: str, quality: int):
+        """Return an open binary file for the variant, generating it first if needed.
+        Handing out an open file keeps a concurrent eviction from pulling it out from under the response.
+        """
+        ext = 'jpg' if fmt == 'jpeg' else fmt
+        target = self.directory / f'{digest[:40]}_w{width}_q{quality}.{ext}'
+        try:
+            f = open(target, 'rb')
+            os.utime(target)
+            return f
+        except FileNotFoundError:
+            pass
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with Image.open(path) as im:
+            im.thumbnail((width, width * 8))  # bound the width only; never upscales
+            if fmt == 'jpeg' and im.mode not in ('RGB', 'L'):
+                im = im.convert('RGB')
+            fd, tmp = tempfile.mkstemp(dir=str(self.directory), suffix='.' + ext)
+            os.close(fd)
+            try:
+                im.save(tmp, IMAGE_VARIANT_FORMATS[fmt][0], quality=quality)
+                os.replace(tmp, target)
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        f = open(target, 'rb')
+        self._evict(keep=target)
+        return f
+
+    def _evict(self, keep: Path = None):
+        with self._lock:
+            entries = []
+            total = 0
+            for p in self.directory.iterdir():
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                total += st.st_size
+                if p != keep:
+                    entries.append((st.st_mtime, st.st_size, p))
+            entries.sort()
+            for _, size, p in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    p.unlink()
+                    total -= size
+                except OSError:
+                    pass  # still open elsewhere (Windows) or already gone
+
+
+IMAGE_VARIANTS = ImageVariantCache(IMAGE_VARIANT_DIR, IMAGE_VARIANT_MAX_BYTES)
+
+# /pipeline job output lives outside generated_images/, which generate_images_from_scenes.py clears
+# on every /generate_image run; it is still served as /static/generated_images/job_<id>/<name>
+PIPELINE_JOB_DIR = Path(os.environ.get('PIPELINE_JOB_DIR', str(ROOT / 'pipeline_jobs')))
+# upper bound on image threads per /pipeline job (also capped by the image pool limit)
+PIPELINE_MAX_WORKERS = int(os.environ.get('PIPELINE_MAX_WORKERS', 4))
+
+
+WORK_STORE_PATH = os.environ.get('WORK_STORE_PATH', str(ROOT / 'works.db'))
+_work_store = None
+_work_store_lock = threading.Lock()
+
+
+def work_store():
+    """The shared WorkStore, opened on first use."""
+    global _work_store
+    with _work_store_lock:
+        if _work_store is None:
+            if str(ROOT) not in sys.path:
+                sys.path.insert(0, str(ROOT))
+            from work_store import WorkStore
+            _work_store = WorkStore(WORK_STORE_PATH)
+        return _work_store
+
+
+def save_requested(payload: dict) -> bool:
+    """Results are persisted when the request asks for it or names an existing work."""
+    return bool(payload.get('save') or payload.get('work_id') or payload.get('workId'))
+
+
+def save_work(payload: dict, text: str, result: dict, mode: str, density: float, images: dict = None) -> str:
+    return work_store().save_analysis(
+        text, result,
+        work_id=payload.get('work_id') or payload.get('workId'),
+        title=payload.get('title'),
+        author=payload.get('author'),
+        description=payload.get('description'),
+        mode=mode, density=density, images=images)
+
+
+# frontend parameter names -> backend names; both snake_case and camelCase are accepted
+AI_KEY_MAP = {
+    'api_key': ['api_key', 'apiKey', 'api_key'],
+    'api_url': ['api_url', 'apiUrl', 'api_url'],
+    'model': ['model', 'model'],
+    'provider': ['provider', 'provider'],
+    'prompt_version': ['prompt_version', 'promptVersion'],
+    'hybrid_band': ['hybrid_band', 'hybridBand'],
+    'hybrid_max_calls': ['hybrid_max_calls', 'hybridMaxCalls'],
+    'hybrid_batch_size': ['hybrid_batch_size', 'hybridBatchSize'],
+    'hybrid_window': ['hybrid_window', 'hybridWindow']
+}
+# image params are handed to generate_images_from_scenes.py as environment variables
+IMAGE_KEY_MAP = {
+    'IMAGE_API_KEY': ['image_api_key', 'imageApiKey', 'image_api_key'],
+    'IMAGE_API_URL': ['image_api_url', 'imageApiUrl', 'image_api_url'],
+    'IMAGE_MODEL': ['image_model', 'imageModel', 'image_model'],
+    'IMAGE_OUTPUT_DIR': ['image_output_dir', 'imageOutputDir', 'image_output_dir'],
+    'IMAGE_SIZE': ['image_size', 'imageSize', 'image_size']
+}
+
+
+def pick_params(payload: dict, key_map: dict) -> dict:
+    """Collect the first non-null candidate key of each entry in key_map from the payload."""
+    out = {}
+    for out_key, candidates in key_map.items():
+        for c in candidates:
+            if c in payload and payload.get(c) is not None:
+                out[out_key] = payload.get(c)
+                break
+    return out
+
+
+def parse_simulate(payload) -> bool:
+    """Simulation is enabled by ?simulate=1 or a truthy payload.simulate (payload wins)."""
+    simulate_q = request.args.get('simulate')
+    simulate_flag = payload.get('simulate') if isinstance(payload, dict) else None
+    simulate = False
+    if simulate_q is not None:
+        try:
+            simulate = bool(int(simulate_q))
+        except Exception:
+            simulate = simulate_q.lower() in ('1', 'true', 'yes')
+    if simulate_flag is not None:
+        simulate = bool(simulate_flag)
+    return simulate
+
 
 def run_story_segmenter(text: str, mode: str = 'heuristic', density: float = 0.5, ai_kwargs: dict = None):
     """Try to run story_segmenter.py via CLI and return parsed JSON.
@@ -48,6 +456,11 @@ def run_story_segmenter(text: str, mode: str = 'heuristic', density: float = 0.5
                     cmd += ['--model', str(ai_kwargs.get('model'))]
                 if ai_kwargs.get('provider'):
                     cmd += ['--provider', str(ai_kwargs.get('provider'))]
+                if ai_kwargs.get('prompt_version'):
+                    cmd += ['--prompt_version', str(ai_kwargs.get('prompt_version'))]
+                for opt in ('hybrid_band', 'hybrid_max_calls', 'hybrid_batch_size', 'hybrid_window'):
+                    if ai_kwargs.get(opt) is not None:
+                        cmd += ['--' + opt, str(ai_kwargs.get(opt))]
             try:
                 proc = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
                 if proc.returncode != 0:
@@ -73,8 +486,10 @@ def run_story_segmenter(text: str, mode: str = 'heuristic', density: float = 0.5
     except Exception as e:
         APP.logger.warning('Fallback import of story_segmenter failed: %s', e)
 
-    # Final fallback: very small heuristic summary
+    # Final fallback: very small heuristic summary; marked so clients (and load_test.py) can tell it from a real result
+    APP.logger.warning('story_segmenter unavailable; returning single-segment fallback')
     return {
+        'fallback': True,
         'segments': [
             {
                 'type': 'scene',
@@ -88,9 +503,27 @@ def run_story_segmenter(text: str, mode: str = 'heuristic', density: float = 0.5
     }
 
 
+@APP.errorhandler(Overloaded)
+def handle_overloaded(e: Overloaded):
+    resp = jsonify({'ok': False, 'error': str(e), 'pool': e.pool, 'retry_after': e.retry_after})
+    resp.status_code = e.status
+    resp.headers['Retry-After'] = str(e.retry_after)
+    return resp
+
+
 @APP.route('/health', methods=['GET'])
 def health():
-    return jsonify({'status': 'ok'})
+    return jsonify({
+        'status': 'ok',
+        'analyze_in_flight': ANALYZE_FLIGHTS.in_flight(),
+        'admission': {name: pool.stats() for name, pool in ADMISSION.items()}
+    })
+
+
+@APP.route('/admission', methods=['GET'])
+def admission():
+    """Current concurrency, queue depth and rejection counters for each admission pool."""
+    return jsonify({name: pool.stats() for name, pool in ADMISSION.items()})
 
 
 @APP.route('/analyze', methods=['POST'])
@@ -98,16 +531,7 @@ def analyze():
     payload = request.get_json(force=True)
     APP.logger.info('[/analyze] incoming payload: %s', json.dumps(payload, ensure_ascii=False))
     # allow quick local simulation via query param or payload flag
-    simulate_q = request.args.get('simulate')
-    simulate_flag = payload.get('simulate') if isinstance(payload, dict) else None
-    simulate = False
-    if simulate_q is not None:
-        try:
-            simulate = bool(int(simulate_q))
-        except Exception:
-            simulate = simulate_q.lower() in ('1', 'true', 'yes')
-    if simulate_flag is not None:
-        simulate = bool(simulate_flag)
+    simulate = parse_simulate(payload)
     text = payload.get('text', '')
     mode = payload.get('mode', 'heuristic')
     density = float(payload.get('density', 0.5))
@@ -133,22 +557,35 @@ def analyze():
 
         # collect ai params forwarded from frontend (optional)
         # Accept both snake_case and camelCase keys from frontend
-        ai_key_map = {
-            'api_key': ['api_key', 'apiKey', 'api_key'],
-            'api_url': ['api_url', 'apiUrl', 'api_url'],
-            'model': ['model', 'model'],
-            'provider': ['provider', 'provider']
-        }
-        ai_kwargs = {}
-        for out_key, candidates in ai_key_map.items():
-            for c in candidates:
-                if c in payload and payload.get(c) is not None:
-                    ai_kwargs[out_key] = payload.get(c)
-                    break
+        ai_kwargs = pick_params(payload, AI_KEY_MAP)
 
         APP.logger.info('[/analyze] forwarding ai_kwargs: %s', json.dumps(ai_kwargs, ensure_ascii=False))
-        res = run_story_segmenter(text, mode=mode, density=density, ai_kwargs=ai_kwargs if ai_kwargs else None)
-        return jsonify({'ok': True, 'result': res})
+        # identical concurrent requests (retries, several screens) share one segmenter run
+        key = analyze_flight_key(text, mode, density, ai_kwargs)
+
+        def compute():
+            # only the single-flight leader takes an admission slot
+            with analyze_pool(mode).slot():
+                return run_story_segmenter(text, mode=mode, density=density, ai_kwargs=ai_kwargs if ai_kwargs else None)
+
+        res, shared = ANALYZE_FLIGHTS.do(key, compute, timeout=ANALYZE_WAIT_TIMEOUT)
+        if shared:
+            APP.logger.info('[/analyze] joined in-flight analysis %s', key[:12])
+        body = {'ok': True, 'result': res, 'shared': shared}
+        if save_requested(payload):
+            body['work_id'] = save_work(payload, text, res, mode, density)
+        return jsonify(body)
+    except Overloaded:
+        raise
+    except SharedCallError as e:
+        # the leader was turned away by admission control: answer this waiter the same way
+        if isinstance(e.__cause__, Overloaded):
+            return handle_overloaded(e.__cause__)
+        APP.logger.warning('analyze failed in shared run: %s', e.__cause__)
+        return jsonify({'ok': False, 'error': str(e.__cause__), 'shared': True}), 500
+    except TimeoutError as e:
+        APP.logger.warning('analyze wait timed out: %s', e)
+        return jsonify({'ok': False, 'error': str(e)}), 504
     except Exception as e:
         APP.logger.exception('analyze failed')
         return jsonify({'ok': False, 'error': str(e)}), 500
@@ -163,16 +600,7 @@ def generate_image():
         return jsonify({'error': 'missing prompt'}), 400
 
     # support simulation via ?simulate=1 or payload.simulate = true
-    simulate_q = request.args.get('simulate')
-    simulate_flag = payload.get('simulate') if isinstance(payload, dict) else None
-    simulate = False
-    if simulate_q is not None:
-        try:
-            simulate = bool(int(simulate_q))
-        except Exception:
-            simulate = simulate_q.lower() in ('1', 'true', 'yes')
-    if simulate_flag is not None:
-        simulate = bool(simulate_flag)
+    simulate = parse_simulate(payload)
 
     if simulate:
         # return a predictable set of filenames that frontend can map to static URLs
@@ -206,46 +634,285 @@ def generate_image():
             # If image ai params provided, pass them via environment variables so the script can pick them up
             env = os.environ.copy()
             # accept both snake_case and camelCase from frontend
-            image_key_map = {
-                'IMAGE_API_KEY': ['image_api_key', 'imageApiKey', 'image_api_key'],
-                'IMAGE_API_URL': ['image_api_url', 'imageApiUrl', 'image_api_url'],
-                'IMAGE_MODEL': ['image_model', 'imageModel', 'image_model'],
-                'IMAGE_OUTPUT_DIR': ['image_output_dir', 'imageOutputDir', 'image_output_dir'],
-                'IMAGE_SIZE': ['image_size', 'imageSize', 'image_size']
-            }
-            for env_name, candidates in image_key_map.items():
-                for c in candidates:
-                    if c in payload and payload.get(c) is not None:
-                        env[env_name] = str(payload.get(c))
-                        break
-            try:
-                proc = subprocess.run(cmd, capture_output=True, text=True, timeout=120, env=env)
-                if proc.returncode != 0:
-                    APP.logger.warning('generate_images_from_scenes failed: %s', proc.stderr)
-                    # Fall through to simulated response
-                else:
-                    # Look for generated_images dir
-                    out_dir = ROOT / 'generated_images'
-                    if out_dir.exists():
-                        files = [str(p.name) for p in sorted(out_dir.iterdir()) if p.is_file()]
-                        return jsonify({'ok': True, 'files': files})
-            except Exception as e:
-                APP.logger.warning('generate_images invocation error: %s', e)
+            env.update({k: str(v) for k, v in pick_params(payload, IMAGE_KEY_MAP).items()})
+            # bounded concurrency: raises Overloaded (429/503) instead of forking without limit
+            with ADMISSION['image'].slot():
+                try:
+                    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=120, env=env)
+                    if proc.returncode != 0:
+                        APP.logger.warning('generate_images_from_scenes failed: %s', proc.stderr)
+                        # Fall through to simulated response
+                    else:
+                        # Look for generated_images dir
+                        out_dir = ROOT / 'generated_images'
+                        if out_dir.exists():
+                            # skip manifest.json and other non-image outputs
+                            files = [str(p.name) for p in sorted(out_dir.iterdir())
+                                     if p.is_file() and p.suffix.lower() in ('.png', '.jpg', '.jpeg', '.webp')]
+                            return jsonify({'ok': True, 'files': files})
+                except Exception as e:
+                    APP.logger.warning('generate_images invocation error: %s', e)
 
     # Simulated response: return a placeholder URL (frontend can handle)
     return jsonify({'ok': True, 'simulated': True, 'url': 'http://localhost:8000/static/placeholder.png', 'note': 'simulated result; configure generate_images_from_scenes.py for real generation'})
 
 
+@APP.route('/pipeline', methods=['POST'])
+def pipeline():
+    """Segment, generate images and assemble Markdown in one request (see story_pipeline.py).
+    Image generation for a scene starts as soon as its segment is final; images and the
+    Markdown land in PIPELINE_JOB_DIR/job_<id>/.
+    The job is admitted as a whole before any work starts: first one image permit per image
+    worker (held until the end, so the image pool limit still bounds upstream image calls),
+    then a slot in the segment/ai pool (released once segmentation finishes). Taking the image
+    permits first means a job queued behind busy image work never sits on a segmentation slot.
+    A saturated server answers 429/503 instead of a 200 full of per-image errors.
+    """
+    payload = request.get_json(force=True)
+    text = payload.get('text', '')
+    mode = payload.get('mode', 'heuristic')
+    if not text:
+        return jsonify({'error': 'missing text'}), 400
+    try:
+        density = float(payload.get('density', 0.5))
+        workers = int(payload.get('workers', 2))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid density or workers'}), 400
+    workers = max(1, min(workers, PIPELINE_MAX_WORKERS, ADMISSION['image'].limit))
+
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    import story_pipeline
+    import story_segmenter
+
+    ai_kwargs = pick_params(payload, AI_KEY_MAP)
+    ai_kwargs.pop('provider', None)
+    image_params = pick_params(payload, IMAGE_KEY_MAP)
+    image_kwargs = {
+        name: image_params[env_name]
+        for env_name, name in (('IMAGE_API_KEY', 'api_key'), ('IMAGE_API_URL', 'api_url'),
+                               ('IMAGE_MODEL', 'model'), ('IMAGE_SIZE', 'image_size'))
+        if env_name in image_params
+    }
+    image_kwargs.setdefault('timeout', 120)
+
+    # admission for the whole job; Overloaded propagates to handle_overloaded (429/503)
+    seg_pool, image_pool = analyze_pool(mode), ADMISSION['image']
+    image_pool.acquire(workers)
+    image_started = time.monotonic()
+    try:
+        seg_pool.acquire()
+    except Overloaded:
+        image_pool.release(time.monotonic() - image_started, workers)
+        raise
+    seg_started = time.monotonic()
+    seg_held = [True]
+
+    def release_segment_slot():
+        if seg_held[0]:
+            seg_held[0] = False
+            seg_pool.release(time.monotonic() - seg_started)
+
+    def segmenter(*args, **kwargs):
+        try:
+            return story_segmenter.segment_story(*args, **kwargs)
+        finally:
+            release_segment_slot()
+
+    job_id = uuid.uuid4().hex[:12]
+    job_dir = PIPELINE_JOB_DIR / f'job_{job_id}'
+    try:
+        report = story_pipeline.run_pipeline(
+            text,
+            density=density,
+            mode=mode,
+            image_dir=str(job_dir),
+            output_md=str(job_dir / 'story.md'),
+            workers=workers,
+            image_kwargs=image_kwargs,
+            segmenter=segmenter,
+            **ai_kwargs
+        )
+    except Exception as e:
+        APP.logger.exception('pipeline failed')
+        return jsonify({'ok': False, 'error': str(e)}), 500
+    finally:
+        # run_pipeline joins its threads, so the segmenter is no longer running here
+        release_segment_slot()
+        image_pool.release(time.monotonic() - image_started, workers)
+
+    files = [f'job_{job_id}/{Path(p).name}' for p in report['images']]
+    work_id = None
+    if save_requested(payload):
+        images = {int(Path(p).stem.split('_')[-1]): f'job_{job_id}/{Path(p).name}' for p in report['images']}
+        work_id = save_work(payload, text, report['result'], mode, density, images=images)
+    return jsonify({
+        'ok': not report['errors'],
+        'job_id': job_id,
+        'work_id': work_id,
+        'result': report['result'],
+        'files': files,
+        'markdown': Path(report['markdown']).read_text(encoding='utf-8'),
+        'markdown_file': f'job_{job_id}/story.md',
+        'reused': report['reused'],
+        'manifest_file': f'job_{job_id}/manifest.json',
+        'errors': report['errors'],
+        'timings': report['timings']
+    })
+
+
+# page size bounds of WorkStore.get_segments; the handlers clamp to the same range so that
+# "a full page came back" reliably means there may be more segments
+SEGMENT_PAGE_MAX = 500
+
+
+def _page_args(default_limit: int):
+    """(start, limit) from the query string, clamped; None when either is not an integer."""
+    try:
+        start, limit = int(request.args.get('start', 0)), int(request.args.get('limit', default_limit))
+    except ValueError:
+        return None
+    return max(0, start), max(1, min(limit, SEGMENT_PAGE_MAX))
+
+
+@APP.route('/works', methods=['GET'])
+def list_works():
+    """Newest-first list of stored works: ?limit=20&cursor=<next_cursor from the previous page>."""
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({'error': 'invalid limit'}), 400
+    works, next_cursor = work_store().list_works(limit=limit, cursor=request.args.get('cursor'))
+    return jsonify({'ok': True, 'works': works, 'next_cursor': next_cursor})
+
+
+@APP.route('/works', methods=['POST'])
+def create_work():
+    """Store an analysis the client already has: { text, result, title?, author?, work_id? }."""
+    payload = request.get_json(force=True)
+    text = payload.get('text', '')
+    result = payload.get('result')
+    if not text or not isinstance(result, dict):
+        return jsonify({'error': 'missing text or result'}), 400
+    density = payload.get('density')
+    if density is not None:
+        try:
+            density = float(density)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'invalid density'}), 400
+    work_id = save_work(payload, text, result, payload.get('mode'), density)
+    return jsonify({'ok': True, 'work_id': work_id})
+
+
+@APP.route('/works/<work_id>', methods=['GET'])
+def get_work(work_id: str):
+    """One work with its twists and the first page of segments (?limit=50, ?text=0 to omit original_text)."""
+    store = work_store()
+    work = store.get_work(work_id, include_text=request.args.get('text', '1') != '0')
+    if work is None:
+        return jsonify({'error': 'work not found'}), 404
+    page = _page_args(50)
+    if page is None:
+        return jsonify({'error': 'invalid start or limit'}), 400
+    _, limit = page
+    segments = store.get_segments(work_id, start=0, limit=limit)
+    return jsonify({
+        'ok': True,
+        'work': work,
+        'segments': segments,
+        'twists': store.get_twists(work_id),
+        'next_start': segments[-1]['seg_index'] + 1 if len(segments) == limit else None
+    })
+
+
+@APP.route('/works/<work_id>/segments', methods=['GET'])
+def get_work_segments(work_id: str):
+    """Page through a work's segments: ?start=0&limit=50&type=scene."""
+    page = _page_args(50)
+    if page is None:
+        return jsonify({'error': 'invalid start or limit'}), 400
+    start, limit = page
+    store = work_store()
+    if store.get_work(work_id, include_text=False) is None:
+        return jsonify({'error': 'work not found'}), 404
+    types = request.args.getlist('type') or None
+    segments = store.get_segments(work_id, start=start, limit=limit, types=types)
+    return jsonify({
+        'ok': True,
+        'segments': segments,
+        'next_start': segments[-1]['seg_index'] + 1 if len(segments) == limit else None
+    })
+
+
+@APP.route('/works/<work_id>/segments/<int:seg_index>/image', methods=['PUT'])
+def attach_work_image(work_id: str, seg_index: int):
+    """Record the image chosen for one segment: { image: 'job_x/scene_000.png' }."""
+    payload = request.get_json(force=True)
+    image = payload.get('image')
+    if not image:
+        return jsonify({'error': 'missing image'}), 400
+    if not work_store().attach_image(work_id, seg_index, image):
+        return jsonify({'error': 'segment not found'}), 404
+    return jsonify({'ok': True})
+
+
+@APP.route('/works/<work_id>', methods=['DELETE'])
+def delete_work(work_id: str):
+    if not work_store().delete_work(work_id):
+        return jsonify({'error': 'work not found'}), 404
+    return jsonify({'ok': True})
+
+
 @APP.route('/static/generated_images/<path:filename>', methods=['GET'])
 def serve_generated_image(filename: str):
-    """Serve generated images from background/generated_images (if present).
+    """Serve generated images from background/generated_images (if present), and /pipeline
+    output (job_<id>/...) from PIPELINE_JOB_DIR.
+    Optional query params return a cached, smaller variant for thumbnails:
+      w   -> max width in px (rounded up to one of IMAGE_VARIANT_WIDTHS)
+      fmt -> 'webp' (default when w is given) or 'jpeg'
+      q   -> encoder quality 30..95 (default 80)
+    Responses carry a strong ETag derived from the source content and honour If-None-Match.
     This is a simple convenience for local testing and should not be used as-is in production
     without proper security controls.
     """
-    out_dir = ROOT / 'generated_images'
+    # pipeline jobs are stored separately (see PIPELINE_JOB_DIR) but share this URL prefix
+    out_dir = PIPELINE_JOB_DIR if filename.startswith('job_') else ROOT / 'generated_images'
     if not out_dir.exists():
         abort(404)
-    return send_from_directory(directory=str(out_dir), path=filename)
+    path = safe_join(str(out_dir), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    digest = IMAGE_VARIANTS.source_hash(path)
+
+    width = request.args.get('w', type=int)
+    fmt = (request.args.get('fmt') or '').lower().replace('jpg', 'jpeg')
+    if (not width and not fmt) or Image is None:
+        if Image is None and (width or fmt):
+            APP.logger.warning('Pillow not installed; serving original image for %s', filename)
+        return send_file(path, etag=digest, max_age=IMAGE_CACHE_MAX_AGE, conditional=True)
+
+    fmt = fmt or 'webp'
+    if fmt not in IMAGE_VARIANT_FORMATS:
+        return jsonify({'error': f'unsupported fmt: {fmt}'}), 400
+    width = next((w for w in IMAGE_VARIANT_WIDTHS if w >= max(1, width or IMAGE_VARIANT_WIDTHS[-1])), IMAGE_VARIANT_WIDTHS[-1])
+    quality = min(95, max(30, request.args.get('q', 80, type=int)))
+    etag = f'{digest[:40]}-w{width}-q{quality}.{fmt}'
+
+    # answer revalidations before touching the variant cache
+    if etag in request.if_none_match:
+        resp = APP.response_class(status=304)
+        resp.set_etag(etag)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+        return resp
+
+    try:
+        variant = IMAGE_VARIANTS.open(path, digest, width, fmt, quality)
+    except Exception as e:
+        APP.logger.warning('image variant failed for %s: %s', filename, e)
+        return send_file(path, etag=digest, max_age=IMAGE_CACHE_MAX_AGE, conditional=True)
+    return send_file(variant, mimetype=IMAGE_VARIANT_FORMATS[fmt][1], etag=etag,
+                     max_age=IMAGE_CACHE_MAX_AGE, conditional=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+story_pipeline.py
+
+功能：
+- 把 分段（story_segmenter）-> 生成图片（generate_images_from_scenes）-> 插图组装（insert_images_into_md）
+  串成一个进程内流水线，不再依赖中间文件逐步传递
+- 第 N 段一确定就开始生成第 N 张图（ai 模式使用流式返回，逐段确定）
+- 图片到达后按段落顺序增量写出 Markdown
+- 各阶段之间用有界队列连接（下游处理不过来时上游自动等待），并统计各阶段耗时
+
+用法示例：
+python story_pipeline.py input_story.txt --mode heuristic --density 0.6 --workers 2
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from story_segmenter import segment_story, read_input_file, write_output_file, write_annotated_file
+from generate_images_from_scenes import (create_prompt, generate_image, reuse_image, write_manifest,
+                                         SceneDeduplicator, DEDUP_THRESHOLD)
+from insert_images_into_md import marker_to_markdown
+
+MARKER_TEMPLATE = "{{seg {id:03d}}}"  # 与 story_segmenter.generate_annotated_text 一致
+
+_DONE = object()  # 队列结束标记
+_POLL = 0.1  # 阻塞的队列操作每隔多久检查一次取消标记（秒）
+
+
+class _Cancelled(Exception):
+    """流水线被取消（组装阶段出错）时，用于中止分段回调。"""
+
+
+def _char_span(seg: Dict[str, Any]):
+    """返回段落的 (start_char, end_char)；缺失或不是整数时返回 None。"""
+    try:
+        return int(seg["start_char"]), int(seg["end_char"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class _Timer:
+    """累计某个阶段的忙碌时间、首次产出时间与处理数量。"""
+
+    def __init__(self, t0: float):
+        self.t0 = t0
+        self.busy = 0.0
+        self.count = 0
+        self.first = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, elapsed: float) -> None:
+        with self._lock:
+            self.busy += elapsed
+            self.count += 1
+            if self.first is None:
+                self.first = time.monotonic() - self.t0
+
+    def finish(self) -> None:
+        self.finished = time.monotonic() - self.t0
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "busy_seconds": round(self.busy, 3),
+            "first_at": None if self.first is None else round(self.first, 3),
+            "finished_at": None if self.finished is None else round(self.finished, 3),
+        }
+
+
+def run_pipeline(text: str,
+                 density: float = 0.5,
+                 mode: str = 'heuristic',
+                 output_md: Optional[str] = None,
+                 image_dir: str = 'generated_images',
+                 workers: int = 2,
+                 queue_size: int = 4,
+                 clean: bool = False,
+                 dedup_threshold: Optional[float] = DEDUP_THRESHOLD,
+                 image_kwargs: Optional[Dict[str, Any]] = None,
+                 generate: Optional[Callable[..., Optional[str]]] = None,
+                 segmenter: Optional[Callable[..., Dict[str, Any]]] = None,
+                 on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                 **segment_kwargs) -> Dict[str, Any]:
+    """
+    运行完整流水线，返回 {"result", "markdown", "images", "manifest", "reused", "errors", "timings"}。
+    - output_md: Markdown 输出路径（默认 image_dir/story.md），随图片到达增量写入
+    - image_dir: 图片目录；clean=True 时先清空（与 generate_images_from_scenes.main 行为一致）
+    - workers: 并行生成图片的线程数；queue_size: 阶段间队列容量
+    - dedup_threshold: 摘要与之前场景近似（>= 阈值）时复用其图片，None 关闭；复用关系写入 image_dir/manifest.json
+    - image_kwargs: 转发给 generate_image（api_url, api_key, model, image_size, timeout）
+    - generate / segmenter: 可替换的图片生成与分段函数（签名同 generate_image / segment_story）
+    - on_event(kind, info): 进度回调，kind 为 'segment' / 'image' / 'markdown'
+    - segment_kwargs: 转发给 segment_story（api_key, model, prompt_version 等）
+    """
+    generate = generate or generate_image
+    segmenter = segmenter or segment_story
+    image_kwargs = dict(image_kwargs or {})
+    workers = max(1, int(workers))
+    queue_size = max(1, int(queue_size))
+
+    if clean and os.path.exists(image_dir):
+        shutil.rmtree(image_dir)
+    os.makedirs(image_dir, exist_ok=True)
+    output_md = output_md or os.path.join(image_dir, "story.md")
+    md_dir = os.path.abspath(os.path.dirname(output_md)) or os.getcwd()
+    os.makedirs(md_dir, exist_ok=True)
+
+    t0 = time.monotonic()
+    timers = {name: _Timer(t0) for name in ("segment", "image", "markdown")}
+    seg_queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+    done_queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+    errors: List[str] = []
+    state: Dict[str, Any] = {"result": None, "count": 0}
+    # candidates: 分段阶段按顺序登记的候选被复用场景（图片可能还在生成）；
+    # dedup: 与 generate_images_from_scenes.main 一致，只登记图片真正生成成功的场景
+    candidates = SceneDeduplicator(dedup_threshold) if dedup_threshold is not None else None
+    dedup = SceneDeduplicator(dedup_threshold) if dedup_threshold is not None else None
+    dedup_lock = threading.Lock()
+    # 每个场景图片完成时置位，复用该图片的后续场景在此等待
+    ready: Dict[int, threading.Event] = {}
+    files: Dict[int, Optional[str]] = {}
+    manifest: Dict[int, Dict[str, Any]] = {}
+    # 组装阶段出错时置位，让阻塞在队列上的分段 / 图片线程退出，而不是永远卡住（并占着准入名额）
+    stop = threading.Event()
+
+    def put(q: "queue.Queue[Any]", item: Any) -> bool:
+        """放入队列，队列满时等待（背压）；流水线被取消时放弃并返回 False。"""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q: "queue.Queue[Any]") -> Any:
+        """取出下一项；流水线被取消时返回 _DONE。"""
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def emit(kind: str, info: Dict[str, Any]) -> None:
+        if on_event is not None:
+            try:
+                on_event(kind, info)
+            except Exception:
+                pass
+
+    # ---- 阶段 1：分段 ----
+    def segment_stage() -> None:
+        last = [time.monotonic()]
+
+        def push(seg: Dict[str, Any]) -> None:
+            now = time.monotonic()
+            timers["segment"].record(now - last[0])
+            idx = state["count"]
+            state["count"] += 1
+            emit("segment", {"index": idx, "summary": seg.get("summary", "")})
+            reuse_of = None
+            if seg.get("type", "scene") == "scene":
+                ready[idx] = threading.Event()
+                # 分段按顺序到达，在这里判重可保证被复用的场景一定先入队
+                dup = candidates.match(seg.get("summary", "")) if candidates else None
+                if dup:
+                    reuse_of = dup
+                elif candidates:
+                    candidates.add(idx, seg.get("summary", ""))
+            if not put(seg_queue, (idx, seg, reuse_of)):  # 队列满时阻塞，形成背压
+                raise _Cancelled()
+            last[0] = time.monotonic()
+
+        kwargs = dict(segment_kwargs)
+        if mode == 'ai':
+            kwargs.setdefault("stream", True)
+        try:
+            state["result"] = segmenter(text, density=density, mode=mode, on_segment=push, **kwargs)
+        except _Cancelled:
+            pass
+        except Exception as e:
+            errors.append(f"segment: {e}")
+        finally:
+            timers["segment"].finish()
+            for _ in range(workers):
+                put(seg_queue, _DONE)
+
+    # ---- 阶段 2：生成图片 ----
+    def image_stage() -> None:
+        while True:
+            item = get(seg_queue)
+            if item is _DONE:
+                put(done_queue, _DONE)
+                return
+            idx, seg, reuse_of = item
+            path = None
+            if seg.get("type", "scene") == "scene":
+                start = time.monotonic()
+                prompt = create_prompt(seg.get("text", ""), seg.get("summary", ""))
+                entry = {"index": idx, "prompt": prompt, "file": None, "reused_from": None}
+                try:
+                    if reuse_of is not None:
+                        # 被复用的场景先出队，已由其他线程处理或正在处理
+                        ready[reuse_of[0]].wait()
+                        if not files.get(reuse_of[0]):
+                            # 候选场景生成失败：改在已成功生成的场景里找
+                            with dedup_lock:
+                                reuse_of = dedup.match(seg.get("summary", ""))
+                        if reuse_of is not None:
+                            path = reuse_image(files[reuse_of[0]], idx, output_dir=image_dir)
+                            entry["reused_from"] = reuse_of[0]
+                            entry["similarity"] = round(reuse_of[1], 3)
+                    if path is None:
+                        path = generate(prompt, idx, output_dir=image_dir, **image_kwargs)
+                        if path and dedup:
+                            files[idx] = path  # 登记前先记下文件，match 到它的线程可以直接复用
+                            with dedup_lock:
+                                dedup.add(idx, seg.get("summary", ""))
+                except Exception as e:
+                    errors.append(f"image {idx}: {e}")
+                finally:
+                    files[idx] = path
+                    entry["file"] = path
+                    manifest[idx] = entry
+                    ready[idx].set()
+                timers["image"].record(time.monotonic() - start)
+                emit("image", {"index": idx, "file": path, "reused_from": entry["reused_from"]})
+            if not put(done_queue, (idx, seg, path)):
+                return
+
+    threads = [threading.Thread(target=segment_stage, name="pipeline-segment", daemon=True)]
+    threads += [threading.Thread(target=image_stage, name=f"pipeline-image-{i}", daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+
+    # ---- 阶段 3：按顺序增量组装 Markdown（在当前线程）----
+    pending: Dict[int, Any] = {}
+    images: Dict[int, Optional[str]] = {}
+    written: List[Any] = []  # 已按顺序写出的 (seg, rendered)
+    last_char = 0  # 字符索引模式下已写出的原文位置
+    # 与 generate_annotated_text 一致：所有段落都有字符索引才用字符模式。
+    # 段落是陆续到达的，先按字符模式写；一旦出现缺少索引的段落，就按文本模式重写已写出的部分。
+    char_mode = True
+    finished_workers = 0
+
+    def write_text_mode(md, seg: Dict[str, Any], rendered: str, first: bool) -> None:
+        if not first:
+            md.write("\n\n")
+        md.write(seg.get("text", "").strip() + " " + rendered)
+
+    try:
+        with open(output_md, "w", encoding="utf-8") as md:
+            while finished_workers < workers:
+                item = done_queue.get()
+                if item is _DONE:
+                    finished_workers += 1
+                    continue
+                idx, seg, path = item
+                pending[idx] = (seg, path)
+                images[idx] = path
+                # 只写出从 len(written) 开始连续到达的段落，保证顺序与注记文本一致
+                while len(written) in pending:
+                    start = time.monotonic()
+                    next_idx = len(written)
+                    seg, path = pending.pop(next_idx)
+                    marker = MARKER_TEMPLATE.format(id=next_idx)
+                    rendered = marker_to_markdown(marker, f"{next_idx:03d}", path, md_dir)
+                    span = _char_span(seg) if char_mode else None
+                    if char_mode and span is None:
+                        char_mode = False
+                        md.seek(0)
+                        md.truncate()
+                        for i, (prev, prev_rendered) in enumerate(written):
+                            write_text_mode(md, prev, prev_rendered, i == 0)
+                    if char_mode:
+                        s_char, e_char = span
+                        body = text[last_char:e_char + 1] if s_char >= last_char else text[s_char:e_char + 1]
+                        last_char = max(last_char, e_char + 1)
+                        md.write(body + " " + rendered)
+                    else:
+                        write_text_mode(md, seg, rendered, next_idx == 0)
+                    written.append((seg, rendered))
+                    md.flush()
+                    timers["markdown"].record(time.monotonic() - start)
+                    emit("markdown", {"index": next_idx})
+            if char_mode and written and last_char < len(text):
+                md.write(text[last_char:])
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        timers["markdown"].finish()
+        timers["image"].finish()
+        for t in threads:
+            t.join()
+
+    entries = [manifest[i] for i in sorted(manifest)]
+    manifest_path = write_manifest(entries, output_dir=image_dir, threshold=dedup_threshold)
+
+    total = time.monotonic() - t0
+    result = state["result"] or {"segments": []}
+    return {
+        "result": result,
+        "markdown": output_md,
+        "images": [images[i] for i in sorted(images) if images[i]],
+        "manifest": manifest_path,
+        "reused": sum(1 for e in entries if e["reused_from"] is not None),
+        "errors": errors,
+        "timings": {
+            "total_seconds": round(total, 3),
+            "workers": workers,
+            "stages": {name: timer.report() for name, timer in timers.items()},
+        },
+    }
+
+
+def print_event(kind: str, info: Dict[str, Any]) -> None:
+    if kind == "segment":
+        print(f"[seg {info['index']:03d}] {info['summary']}", flush=True)
+    elif kind == "markdown":
+        print(f"[md  {info['index']:03d}] 已写入", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分段 -> 生成图片 -> 组装 Markdown 一体化流水线")
+    parser.add_argument("input", help="输入文本文件路径（UTF-8）")
+    parser.add_argument("--out-md", "-o", default=None, help="输出 Markdown 文件（默认 input 去扩展名 + _with_images.md）")
+    parser.add_argument("--image-dir", default="generated_images", help="图片输出目录（运行前清空）")
+    parser.add_argument("--mode", choices=['heuristic', 'ai', 'hybrid'], default='heuristic', help="分段模式")
+    parser.add_argument("--density", type=float, default=0.5, help="分段密集度 0.0..1.0")
+    parser.add_argument("--model", default='gpt-4o-mini', help="模型名（ai / hybrid 模式有效）")
+    parser.add_argument("--api_key", default=None, help="API Key（可不传，从环境 AI_API_KEY 读取）")
+    parser.add_argument("--api_url", default=None, help="API URL（可选）")
+    parser.add_argument("--prompt_version", default='v1', help="AI 提示词协议 v1 / v2（ai 模式有效）")
+    parser.add_argument("--workers", type=int, default=2, help="并行生成图片的线程数")
+    parser.add_argument("--queue-size", type=int, default=4, help="阶段间队列容量")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD, help="摘要相似度 >= 该值时复用前面场景的图片")
+    parser.add_argument("--no-dedup", action="store_true", help="每个场景都生成图片")
+    args = parser.parse_args()
+
+    text = read_input_file(args.input)
+    out_md = args.out_md or os.path.splitext(args.input)[0] + "_with_images.md"
+    segment_kwargs = {"api_key": args.api_key, "model": args.model, "api_url": args.api_url}
+    if args.mode == 'ai':
+        segment_kwargs["prompt_version"] = args.prompt_version
+
+    report = run_pipeline(
+        text,
+        density=args.density,
+        mode=args.mode,
+        output_md=out_md,
+        image_dir=args.image_dir,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        clean=True,
+        dedup_threshold=None if args.no_dedup else args.dedup_threshold,
+        on_event=print_event,
+        **segment_kwargs
+    )
+
+    # 与分步脚本保持相同的中间产物，便于对照
+    write_output_file(args.input + ".json", report["result"])
+    write_annotated_file(args.input, text, report["result"].get("segments", []))
+
+    print(f"✅ 已生成 Markdown 文件：{report['markdown']}")
+    if report["reused"]:
+        print(f"♻️ 近似场景复用图片 {report['reused']} 张，清单：{report['manifest']}")
+    for err in report["errors"]:
+        print(f"⚠️ {err}")
+    print(json.dumps(report["timings"], ensure_ascii=False, indent=2))
+    if report["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+# python story_pipeline.py input_story.txt --mode heuristic --density 0.6
@@ -15,7 +15,8 @@ import json
 import os
 import re
 import math
-from typing import List, Dict, Any, Optional, Tuple, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, Sequence, Iterator, Callable
 
 try:
     import requests
@@ -57,6 +58,34 @@ def split_into_sentences(text: str) -> List[str]:
         merged.append(buffer)
     return merged
 
+def split_into_sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    与 split_into_sentences 切分规则一致，但返回每句在原文中的字符区间 [start, end)（不含首尾空白）。
+    两者返回的句子数量与顺序一一对应，可用句子下标还原字符偏移。
+    """
+    raw = []
+    pos = 0
+    for m in SENTENCE_END_RE.finditer(text):
+        raw.append((pos, m.end()))
+        pos = m.end()
+    raw.append((pos, len(text)))
+    spans = []
+    for a, b in raw:
+        chunk = text[a:b]
+        stripped = chunk.strip()
+        if not stripped:
+            continue
+        a += len(chunk) - len(chunk.lstrip())
+        spans.append((a, a + len(stripped)))
+    # 合并规则与 split_into_sentences 相同
+    merged = []
+    for a, b in spans:
+        if merged and b - a < 6:
+            merged[-1] = (merged[-1][0], b)
+        else:
+            merged.append((a, b))
+    return merged
+
 # ---------------------------
 # Heuristic segmentation
 # ---------------------------
@@ -68,25 +97,19 @@ SCENE_BREAK_KEYWORDS = [
 
 DIALOGUE_RE = re.compile(r'^[「“"].+[」”"]$')
 
-def heuristic_segment(text: str, density: float = 0.5) -> Dict[str, Any]:
-    """
-    启发式分段算法（离线可用）。
-    density: 0..1, 值越大 -> 更多分段（更细）
-    """
-    sentences = split_into_sentences(text)
-    n = len(sentences)
-    if n == 0:
-        return {"segments": []}
-
-    # 目标段数基于文本长度和密集度：min 1, max roughly n/2
+def target_segment_count(n: int, density: float) -> int:
+    """目标段数基于句子数和密集度：min 1, max roughly n/2"""
     min_seg = 1
     max_seg = max(1, n // 2)
     # map density to target segments (可调整映射)
     target_segments = min_seg + int((max_seg - min_seg) * density + 0.5)
-    target_segments = max(1, min(target_segments, n))
+    return max(1, min(target_segments, n))
 
-    # 给每个可能边界评分（越高倾向于断开）
-    scores = [0.0] * (n-1)  # boundary between sentence i and i+1
+
+def score_boundaries(sentences: Sequence[str]) -> List[float]:
+    """给每个可能边界评分（越高倾向于断开），scores[i] 对应句 i 与 i+1 之间的边界。"""
+    n = len(sentences)
+    scores = [0.0] * max(0, n-1)
     for i in range(n-1):
         a = sentences[i]
         b = sentences[i+1]
@@ -109,24 +132,27 @@ def heuristic_segment(text: str, density: float = 0.5) -> Dict[str, Any]:
         if re.search(r'[？！!?。\.]+$', a.strip()):
             score += 0.3
         scores[i] = score
+    return scores
 
-    # 选择 top-k 分割点
-    # 先根据 density 调整阈值：更高 density -> 选择更多边界
-    # 我们直接选择 k = target_segments - 1 的边界（如果为0则不选）
-    k = max(0, target_segments - 1)
-    indices = []
-    if k > 0:
-        # pick k largest scores, but keep them ordered
-        indexed = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)
-        topk = sorted([idx for idx, sc in indexed[:k]])
-        indices = topk
-
-    # build segments
+
+def select_top_boundaries(scores: Sequence[float], k: int) -> List[int]:
+    """选择得分最高的 k 个边界，按位置升序返回。"""
+    if k <= 0:
+        return []
+    # pick k largest scores, but keep them ordered
+    indexed = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)
+    return sorted([idx for idx, sc in indexed[:k]])
+
+
+def build_segments(sentences: Sequence[str], cuts: Sequence[int]) -> List[Dict[str, Any]]:
+    """按边界下标（在句 cut 之后断开）组装 segments。"""
+    n = len(sentences)
     segs = []
     start = 0
-    for cut in indices:
-        seg_sents = sentences[start:cut+1]
-        seg_text = " ".join(seg_sents).strip()
+    for cut in list(cuts) + [n-1]:
+        if cut < start:
+            continue
+        seg_text = " ".join(sentences[start:cut+1]).strip()
         segs.append({
             "type": "scene",  # heuristic 不区分细化类型，后面可再分类
             "start_sentence": start,
@@ -135,19 +161,14 @@ def heuristic_segment(text: str, density: float = 0.5) -> Dict[str, Any]:
             "summary": summarize_text_simple(seg_text)
         })
         start = cut+1
-    # last segment
-    seg_text = " ".join(sentences[start:]).strip()
-    segs.append({
-        "type": "scene",
-        "start_sentence": start,
-        "end_sentence": n-1,
-        "text": seg_text,
-        "summary": summarize_text_simple(seg_text)
-    })
-
-    # 找出转折点（heuristic：以“但是”、“然而”、“然而，”等为线索）
+    return segs
+
+
+TWIST_WORDS = ["但是", "然而", "可却", "可见", "却", "不过", "结果", "出乎意料"]
+
+def find_twists(sentences: Sequence[str]) -> List[Dict[str, Any]]:
+    """找出转折点（heuristic：以“但是”、“然而”、“然而，”等为线索）"""
     twists = []
-    TWIST_WORDS = ["但是", "然而", "可却", "可见", "却", "不过", "结果", "出乎意料"]
     for i, s in enumerate(sentences):
         for tw in TWIST_WORDS:
             if tw in s and len(s) > 6:
@@ -157,8 +178,28 @@ def heuristic_segment(text: str, density: float = 0.5) -> Dict[str, Any]:
                     "cue": tw
                 })
                 break
+    return twists
 
-    return {"segments": segs, "twists": twists, "sentence_count": n}
+
+def heuristic_segment(text: str, density: float = 0.5) -> Dict[str, Any]:
+    """
+    启发式分段算法（离线可用）。
+    density: 0..1, 值越大 -> 更多分段（更细）
+    """
+    sentences = split_into_sentences(text)
+    n = len(sentences)
+    if n == 0:
+        return {"segments": []}
+
+    target_segments = target_segment_count(n, density)
+    scores = score_boundaries(sentences)
+
+    # 选择 top-k 分割点
+    # 我们直接选择 k = target_segments - 1 的边界（如果为0则不选）
+    indices = select_top_boundaries(scores, target_segments - 1)
+
+    segs = build_segments(sentences, indices)
+    return {"segments": segs, "twists": find_twists(sentences), "sentence_count": n}
 
 
 def summarize_text_simple(text: str, max_chars: int = 120) -> str:
@@ -216,13 +257,28 @@ AI_PROMPT_TEMPLATE = """
 }}
 """
 
-def call_ai_api_openai_like(text: str, density: float = 0.5, model: str = "gpt-4o-mini", api_key: Optional[str] = None, api_url: Optional[str] = None, timeout: int = 30) -> Dict[str, Any]:
-    """
-    示例：用通用 REST 风格调用 OpenAI-like API（可按需替换为具体 SDK）。
-    - api_key: 若 None 则从环境变量 AI_API_KEY 读取
-    - api_url: 若 None，使用一个示例默认端点（你应该替换为实际端点）
-    注意：这是一个示例实现，具体字段需要根据你使用的 API调整（model 名称、输入字段等）。
-    """
+# v2：句子编号协议。本地先切句并编号，模型只返回每段起始句下标与简短线索，
+# 字符偏移和文本切片在本地根据句子区间还原（偏移总是有效，输出 token 更少）。
+AI_PROMPT_TEMPLATE_V2 = """
+你是一个文本结构分析器（Chinese）。下面是已切分并编号的叙事文本句子，请把它划分为“场景/段落/转折点”。只输出严格有效的 JSON。
+density={density_val}（0.0~1.0，越大分段越细）。
+
+输出格式（使用紧凑键名）：
+{{"segments":[{{"s":<起始句编号>,"t":"scene"|"paragraph"|"turning_point","c":"<不超过20字的画面线索>"}}],"twists":[{{"i":<句子编号>,"c":"<转折线索词>"}}]}}
+
+要求：
+- segments 按 s 升序，第一段 s=0；每段自动延续到下一段起始句之前。
+- 不要复述原文，不要输出任何多余文字。
+
+句子：
+{numbered_sentences}
+"""
+
+AI_PROMPT_VERSIONS = ("v1", "v2")
+
+
+def _chat_request(prompt: str, model: str, api_key: Optional[str], api_url: Optional[str], max_tokens: int, stream: bool = False) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """构造 chat completion 请求，返回 (api_url, headers, payload)。"""
     if requests is None:
         raise RuntimeError("requests 未安装，请 pip install requests 或使用 heuristic 模式")
 
@@ -235,11 +291,6 @@ def call_ai_api_openai_like(text: str, density: float = 0.5, model: str = "gpt-4
     if api_url is None:
         api_url = "https://api.openai.com/v1/chat/completions"
 
-    prompt = AI_PROMPT_TEMPLATE.format(
-        text_json=json.dumps(text, ensure_ascii=False),
-        density_val=float(density)
-    )
-
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -252,8 +303,16 @@ def call_ai_api_openai_like(text: str, density: float = 0.5, model: str = "gpt-4
             {"role": "user", "content": prompt}
         ],
         "temperature": 0.0,
-        "max_tokens": 1500
+        "max_tokens": max_tokens
     }
+    if stream:
+        payload["stream"] = True
+    return api_url, headers, payload
+
+
+def _chat_completion(prompt: str, model: str, api_key: Optional[str], api_url: Optional[str], timeout: int, max_tokens: int = 1500) -> str:
+    """发送一次 chat completion 请求，返回 choices[0].message.content。"""
+    api_url, headers, payload = _chat_request(prompt, model, api_key, api_url, max_tokens)
 
     resp = requests.post(api_url, headers=headers, data=json.dumps(payload), timeout=timeout)
     if resp.status_code != 200:
@@ -262,10 +321,42 @@ def call_ai_api_openai_like(text: str, density: float = 0.5, model: str = "gpt-4
 
     # 解析返回（这里假定返回在 choices[0].message.content）
     try:
-        content = data["choices"][0]["message"]["content"]
+        return data["choices"][0]["message"]["content"]
     except Exception:
         raise RuntimeError("无法解析 API 返回结构，请根据你使用的 API 调整解析代码。")
 
+
+def _chat_completion_stream(prompt: str, model: str, api_key: Optional[str], api_url: Optional[str], timeout: int, max_tokens: int = 1500) -> Iterator[str]:
+    """以 stream=True 发送请求，逐块 yield choices[0].delta.content（OpenAI 兼容的 SSE 格式）。"""
+    api_url, headers, payload = _chat_request(prompt, model, api_key, api_url, max_tokens, stream=True)
+
+    resp = requests.post(api_url, headers=headers, data=json.dumps(payload), timeout=timeout, stream=True)
+    try:
+        if resp.status_code != 200:
+            raise RuntimeError(f"API 请求失败：{resp.status_code} {resp.text}")
+        # text/event-stream 未声明 charset 时 requests 会按 ISO-8859-1 解码，中文会乱码
+        resp.encoding = "utf-8"
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            piece = (choices[0].get("delta") or {}).get("content")
+            if piece:
+                yield piece
+    finally:
+        resp.close()
+
+
+def _parse_model_json(content: str) -> Dict[str, Any]:
     # 有时模型会在 JSON 前后加说明文本，尝试提取首个 JSON 对象
     j = extract_json_from_text(content)
     if j is None:
@@ -276,51 +367,510 @@ def call_ai_api_openai_like(text: str, density: float = 0.5, model: str = "gpt-4
             raise RuntimeError("模型返回内容中未能找到 JSON。返回原文片段：\n" + content[:1000])
     return j
 
+
+def build_sentence_prompt(text: str, density: float) -> Tuple[str, List[Tuple[int, int]]]:
+    """构造 v2 提示词，返回 (prompt, 句子字符区间)。"""
+    spans = split_into_sentence_spans(text)
+    numbered = "\n".join(f"[{i}] {text[a:b]}" for i, (a, b) in enumerate(spans))
+    prompt = AI_PROMPT_TEMPLATE_V2.format(numbered_sentences=numbered, density_val=float(density))
+    return prompt, spans
+
+
+def _as_index(v: Any, n: int) -> Optional[int]:
+    try:
+        i = int(v)
+    except (TypeError, ValueError):
+        return None
+    # 越界的下标直接丢弃（夹到 n-1 会凭空多出一个单句的末段）
+    return i if 0 <= i < n else None
+
+
+def segments_from_sentence_indices(text: str, spans: Sequence[Tuple[int, int]], result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把 v2 协议的模型输出（起始句下标 + 线索）还原为与 v1 相同结构的结果：
+    start_char / end_char（end 为包含式）、start_sentence / end_sentence、text、summary、cues。
+    非法、越界或重复的下标会被丢弃，保证各段连续覆盖全文。
+    """
+    n = len(spans)
+    if n == 0:
+        return {"segments": [], "twists": [], "sentence_count": 0}
+
+    starts = {}
+    for raw in result.get("segments") or []:
+        if not isinstance(raw, dict):
+            continue
+        i = _as_index(raw.get("s", raw.get("start")), n)
+        if i is None or i in starts:
+            continue
+        starts[i] = raw
+    if 0 not in starts:
+        starts[0] = {}
+    order = sorted(starts)
+
+    segs = []
+    for k, first in enumerate(order):
+        last = order[k + 1] - 1 if k + 1 < len(order) else n - 1
+        raw = starts[first]
+        start_char = spans[first][0]
+        end_char = spans[last][1] - 1
+        seg_text = text[start_char:end_char + 1]
+        cue = str(raw.get("c") or raw.get("cue") or "").strip()
+        seg_type = raw.get("t") or raw.get("type") or "scene"
+        if seg_type not in ("scene", "paragraph", "turning_point"):
+            seg_type = "scene"
+        segs.append({
+            "id": k + 1,
+            "type": seg_type,
+            "start_sentence": first,
+            "end_sentence": last,
+            "start_char": start_char,
+            "end_char": end_char,
+            "text": seg_text,
+            "summary": cue or summarize_text_simple(seg_text),
+            "cues": [cue] if cue else []
+        })
+
+    twists = []
+    seen = set()
+    for raw in result.get("twists") or []:
+        if not isinstance(raw, dict):
+            continue
+        i = _as_index(raw.get("i", raw.get("sentence_index")), n)
+        if i is None or i in seen:
+            continue
+        seen.add(i)
+        a, b = spans[i]
+        twists.append({
+            "sentence_index": i,
+            "char_index": a,
+            "text": text[a:b],
+            "cue": str(raw.get("c") or raw.get("cue") or "")
+        })
+    twists.sort(key=lambda t: t["sentence_index"])
+
+    return {"segments": segs, "twists": twists, "sentence_count": n}
+
+
+def _with_text(text: str, seg: Dict[str, Any]) -> Dict[str, Any]:
+    """v1 结果只有字符偏移时补上 text 切片（end_char 为包含式），便于后续生成图片提示词。"""
+    if "text" not in seg:
+        try:
+            seg["text"] = text[int(seg["start_char"]):int(seg["end_char"]) + 1]
+        except (KeyError, TypeError, ValueError):
+            pass
+    return seg
+
+
+def call_ai_api_openai_like(text: str, density: float = 0.5, model: str = "gpt-4o-mini", api_key: Optional[str] = None, api_url: Optional[str] = None, timeout: int = 30, prompt_version: str = "v1",
+                            stream: bool = False, on_segment: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    示例：用通用 REST 风格调用 OpenAI-like API（可按需替换为具体 SDK）。
+    - api_key: 若 None 则从环境变量 AI_API_KEY 读取
+    - api_url: 若 None，使用一个示例默认端点（你应该替换为实际端点）
+    - prompt_version: 'v1' 全文 + 字符偏移（AI_PROMPT_TEMPLATE）；'v2' 编号句子 + 起始句下标（AI_PROMPT_TEMPLATE_V2）
+    - stream: 使用流式返回，segments 数组中每个对象一闭合就解析；已回调的 segment 一定出现在返回结果中
+      （v2 丢弃落在已回调段落内的乱序起始句；已回调的候选 JSON 最终解析失败时抛出 RuntimeError）
+    - on_segment: 每个 segment 确定后回调一次（非流式时在返回前依次回调）；返回值仍是完整结果
+    注意：这是一个示例实现，具体字段需要根据你使用的 API调整（model 名称、输入字段等）。
+    """
+    prompt_version = (prompt_version or "v1").lower()
+    if prompt_version not in AI_PROMPT_VERSIONS:
+        raise ValueError(f"未知的 prompt_version: {prompt_version}")
+
+    spans: List[Tuple[int, int]] = []
+    if prompt_version == "v2":
+        prompt, spans = build_sentence_prompt(text, density)
+        # v2 只返回下标与短线索，输出远小于 v1
+        max_tokens = 800
+    else:
+        prompt = AI_PROMPT_TEMPLATE.format(
+            text_json=json.dumps(text, ensure_ascii=False),
+            density_val=float(density)
+        )
+        max_tokens = 1500
+
+    def finish(result: Dict[str, Any]) -> Dict[str, Any]:
+        if prompt_version == "v2":
+            return segments_from_sentence_indices(text, spans, result)
+        for seg in result.get("segments") or []:
+            if isinstance(seg, dict):
+                _with_text(text, seg)
+        return result
+
+    if not stream:
+        content = _chat_completion(prompt, model, api_key, api_url, timeout, max_tokens=max_tokens)
+        result = finish(_parse_model_json(content))
+        if on_segment is not None:
+            for seg in result.get("segments") or []:
+                on_segment(seg)
+        return result
+
+    emitted = 0
+    # 只有一个候选对象的元素会被流式回调；它若最终解析失败，已回调的 segment 无法撤回
+    streamed: Dict[str, Optional[int]] = {"candidate": None}
+    raw_items: List[Dict[str, Any]] = []
+    emitted_until = 0  # v2：已回调的 segment 覆盖到的句子（不含）
+
+    def on_item(item: Any) -> None:
+        nonlocal emitted, emitted_until
+        if not isinstance(item, dict):
+            return
+        if streamed["candidate"] is None:
+            streamed["candidate"] = parser.candidate
+        elif streamed["candidate"] != parser.candidate:
+            return  # 之前的候选解析失败后出现的新候选：等最终结果，不再流式回调
+        if prompt_version == "v1":
+            emitted += 1
+            if on_segment is not None:
+                on_segment(_with_text(text, item))
+            return
+        # v2 中一段的结束句取决于下一段的起始句，因此收到下一段时才确定上一段。
+        # 落在已回调 segment 内的起始句（乱序到达）会改变已回调段的结束句，直接丢弃
+        start = _as_index(item.get("s", item.get("start")), len(spans))
+        if start is not None and 0 < start < emitted_until:
+            return
+        raw_items.append(item)
+        done = segments_from_sentence_indices(text, spans, {"segments": raw_items})["segments"][:-1]
+        for seg in done[emitted:]:
+            if on_segment is not None:
+                on_segment(seg)
+        emitted = max(emitted, len(done))
+        if done:
+            emitted_until = done[-1]["end_sentence"] + 1
+
+    parser = IncrementalJSONParser(on_item=on_item)
+    chunks = []
+    for piece in _chat_completion_stream(prompt, model, api_key, api_url, timeout, max_tokens=max_tokens):
+        chunks.append(piece)
+        parser.feed(piece)
+    if parser.result is None:
+        raise RuntimeError("模型返回内容中未能找到 JSON。返回原文片段：\n" + "".join(chunks)[:1000])
+    if emitted and parser.result_candidate != streamed["candidate"]:
+        raise RuntimeError(f"流式返回的 JSON 在回调 {emitted} 个 segment 后解析失败，最终结果与已回调的 segment 不一致")
+    if prompt_version == "v2" and emitted:
+        # 与流式阶段一致：丢弃落在已回调 segment 内的起始句，保证已回调的段落不变
+        kept = []
+        for raw in parser.result.get("segments") or []:
+            start = _as_index(raw.get("s", raw.get("start")), len(spans)) if isinstance(raw, dict) else None
+            if start is not None and 0 < start < emitted_until and not any(
+                    _as_index(r.get("s", r.get("start")), len(spans)) == start for r in raw_items):
+                continue
+            kept.append(raw)
+        parser.result["segments"] = kept
+    result = finish(parser.result)
+    # 补发尚未回调的 segment（v2 的最后一段，或流式解析时未能闭合的对象）
+    if on_segment is not None:
+        for seg in (result.get("segments") or [])[emitted:]:
+            on_segment(seg)
+    return result
+
+class IncrementalJSONParser:
+    """
+    增量 JSON 提取器：逐块 feed 模型输出，每个字符只处理一次（线性时间）。
+    - 跳过 JSON 之前的说明文字（如 ```json 代码块标记）；
+    - 跟踪字符串与转义，字符串中的括号不会影响配对；
+    - 顶层对象中 array_key（默认 "segments"）数组的元素对象一闭合就解析，并通过 on_item 回调给出；
+    - 首个能成功解析的顶层对象保存在 result；解析失败的候选会被丢弃并继续寻找下一个。
+    - candidate 为当前候选对象的序号（每丢弃一个候选加 1），on_item 回调时可据此判断元素属于哪个候选；
+      result_candidate 为 result 所属候选的序号。已回调的元素不会因候选失败而撤回，由调用方决定如何处理。
+    """
+
+    def __init__(self, array_key: str = "segments", on_item: Optional[Callable[[Any], None]] = None):
+        self.array_key = array_key
+        self.on_item = on_item
+        self.result: Optional[Dict[str, Any]] = None
+        self.candidate = 0
+        self.result_candidate: Optional[int] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._stack: List[List[Any]] = []  # [类型 'obj'/'arr', 是否等待键, 当前键]
+        self._in_str = False
+        self._esc = False
+        self._key_chars: Optional[List[str]] = None
+        self._root: List[str] = []
+        self._item: Optional[List[str]] = None
+
+    def feed(self, chunk: str) -> List[Any]:
+        """喂入一块文本，返回本块中新闭合的数组元素。"""
+        items = []
+        for ch in chunk:
+            if self.result is not None:
+                break
+            stack = self._stack
+            if not stack:
+                if ch == '{':
+                    stack.append(['obj', True, None])
+                    self._root = ['{']
+                continue
+            self._root.append(ch)
+            if self._item is not None:
+                self._item.append(ch)
+
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == '\\':
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                    if self._key_chars is not None:
+                        raw = "".join(self._key_chars)
+                        try:
+                            stack[-1][2] = json.loads('"' + raw + '"')
+                        except ValueError:
+                            stack[-1][2] = raw
+                        self._key_chars = None
+                    continue
+                if self._key_chars is not None:
+                    self._key_chars.append(ch)
+                continue
+
+            top = stack[-1]
+            if ch == '"':
+                self._in_str = True
+                self._key_chars = [] if (top[0] == 'obj' and top[1]) else None
+            elif ch == '{' or ch == '[':
+                # 顶层对象 -> array_key 数组 -> 元素对象
+                if (ch == '{' and len(stack) == 2 and top[0] == 'arr'
+                        and stack[0][2] == self.array_key and self._item is None):
+                    self._item = ['{']
+                stack.append(['obj', True, None] if ch == '{' else ['arr', False, None])
+            elif ch == '}' or ch == ']':
+                frame = stack.pop()
+                if frame[0] != ('obj' if ch == '}' else 'arr'):
+                    self._reset()  # 括号不匹配，放弃当前候选
+                    self.candidate += 1
+                    continue
+                if not stack:
+                    try:
+                        obj = json.loads("".join(self._root))
+                    except ValueError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        self.result = obj
+                        self.result_candidate = self.candidate
+                    else:
+                        self.candidate += 1
+                    self._reset()
+                elif self._item is not None and len(stack) == 2:
+                    try:
+                        item = json.loads("".join(self._item))
+                    except ValueError:
+                        item = None
+                    self._item = None
+                    if item is not None:
+                        items.append(item)
+                        if self.on_item is not None:
+                            self.on_item(item)
+            elif ch == ':':
+                if top[0] == 'obj':
+                    top[1] = False
+            elif ch == ',':
+                if top[0] == 'obj':
+                    top[1] = True
+        return items
+
+
 def extract_json_from_text(s: str) -> Optional[Dict[str, Any]]:
-    """从较长文本中抓取第一个大括号包裹的 JSON 对象（简单实现）。"""
-    s = s.strip()
-    # 寻找第一个 { 并匹配到对应的 }
-    start = s.find('{')
-    if start == -1:
+    """从较长文本中抓取第一个能成功解析的大括号 JSON 对象（线性时间，容忍字符串内的括号）。"""
+    parser = IncrementalJSONParser()
+    parser.feed(s)
+    return parser.result
+
+# ---------------------------
+# Hybrid segmentation（启发式 + AI 仅判定模糊边界）
+# ---------------------------
+
+AI_BOUNDARY_PROMPT_TEMPLATE = """
+你是一个叙事文本场景边界判定器（Chinese）。下面每行给出一个候选边界编号，以及边界前后的几句原文，“||” 表示边界位置。
+请判断每个边界处是否应当切换到新的场景/段落。density={density_val}（0.0~1.0，越大越倾向于切分）。
+只输出严格有效的 JSON，格式：{{"b":[{{"id":<边界编号>,"cut":1 或 0}}]}}
+
+候选边界：
+{boundaries}
+"""
+
+
+def _boundary_context(sentences: Sequence[str], i: int, window: int) -> str:
+    before = sentences[max(0, i - window + 1):i + 1]
+    after = sentences[i + 1:i + 1 + window]
+    return f"[B{i}] " + " ".join(before) + " || " + " ".join(after)
+
+
+# hybrid 模式每篇文档同时在途的模型调用上限（与 max_ai_calls 默认值一致）；
+# 默认预算内批次并发执行，总耗时约等于一次调用的 timeout，不会累加到 max_ai_calls * timeout
+# （server.py 的分段子进程 60 秒超时）。server.py 中一个 hybrid 请求只占一个 ai 名额，
+# 因此这里的上限也决定了 ai 名额实际对应的模型并发数。
+HYBRID_MAX_PARALLEL = 3
+
+_BOUNDARY_ID = re.compile(r"[Bb]?\s*(\d+)")
+
+_CUT_WORDS = {"1": True, "true": True, "yes": True, "y": True, "cut": True, "是": True, "断": True,
+              "0": False, "false": False, "no": False, "n": False, "keep": False, "否": False, "不断": False}
+
+
+def _parse_cut(v: Any) -> Optional[bool]:
+    """解析模型给出的 cut 值；无法识别时返回 None（沿用启发式决定）。"""
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, (int, float)):
+        return v != 0
+    if isinstance(v, str):
+        return _CUT_WORDS.get(v.strip().lower())
+    return None
+
+
+def _parse_boundary_id(v: Any) -> Optional[int]:
+    """解析模型给出的边界编号；提示词里写作 [B12]，模型常原样回答 "B12"。"""
+    if isinstance(v, bool):
         return None
-    stack = 0
-    for i in range(start, len(s)):
-        if s[i] == '{':
-            stack += 1
-        elif s[i] == '}':
-            stack -= 1
-            if stack == 0:
-                candidate = s[start:i+1]
+    if isinstance(v, int):
+        return v
+    m = _BOUNDARY_ID.fullmatch(str(v).strip().strip("[]")) if v is not None else None
+    return int(m.group(1)) if m else None
+
+
+def _judge_boundaries(sentences: List[str], batch: List[int], density: float, window: int,
+                      model: str, api_key: Optional[str], api_url: Optional[str],
+                      timeout: int) -> Tuple[Dict[int, bool], int]:
+    """让模型判定一批边界，返回 ({边界编号: 是否断开}, 无法对应到本批次的条目数)；
+    只收录本批次内、cut 可识别的条目。"""
+    prompt = AI_BOUNDARY_PROMPT_TEMPLATE.format(
+        boundaries="\n".join(_boundary_context(sentences, i, window) for i in batch),
+        density_val=float(density)
+    )
+    content = _chat_completion(prompt, model, api_key, api_url, timeout, max_tokens=20 * len(batch) + 50)
+    result = _parse_model_json(content)
+    if not isinstance(result, dict):
+        raise RuntimeError(f"模型返回的不是 JSON 对象：{type(result).__name__}")
+    items = result.get("b") or []
+    if not isinstance(items, list):
+        raise RuntimeError("模型返回的 b 不是数组")
+    wanted = set(batch)
+    decisions: Dict[int, bool] = {}
+    unmatched = 0
+    for item in items:
+        i = _parse_boundary_id(item.get("id")) if isinstance(item, dict) else None
+        cut = _parse_cut(item.get("cut")) if i in wanted else None
+        if cut is None:
+            unmatched += 1
+            continue
+        decisions[i] = cut
+    return decisions, unmatched
+
+
+def hybrid_segment(text: str, density: float = 0.5, model: str = "gpt-4o-mini", api_key: Optional[str] = None, api_url: Optional[str] = None, timeout: int = 30,
+                   band: float = 0.5, max_ai_calls: int = 3, batch_size: int = 8, window: int = 2) -> Dict[str, Any]:
+    """
+    混合模式：先用启发式给所有边界打分，以 top-k 选中的最低分（分数线）为中心：
+    - 得分 >= 分数线 + band 的强边界直接断开，得分 <= 分数线 - band 的弱边界直接不断；
+    - 落在置信带内的边界连同前后 window 句，按 batch_size 分批交给模型判定，最多 max_ai_calls 次调用，
+      各批次并发执行（最多 HYBRID_MAX_PARALLEL 个同时在途）；
+    - 超出预算、调用失败、返回格式不对或模型漏答的边界沿用启发式 top-k 的决定。
+    结果附带 "hybrid" 统计字段，便于观察实际送给模型的边界数量。
+    """
+    sentences = split_into_sentences(text)
+    n = len(sentences)
+    if n == 0:
+        return {"segments": []}
+
+    scores = score_boundaries(sentences)
+    k = target_segment_count(n, density) - 1
+    prior = set(select_top_boundaries(scores, k))
+
+    uncertain = []
+    # k == 0 或 k == n-1 时 density 已完全决定结果，没有模糊边界
+    if 0 < k < n - 1 and band > 0:
+        cutoff = sorted(scores, reverse=True)[k - 1]
+        uncertain = [i for i, sc in enumerate(scores) if abs(sc - cutoff) < band]
+        # 越接近分数线越模糊，优先送给模型
+        uncertain.sort(key=lambda i: (abs(scores[i] - cutoff), i))
+
+    budget = max(0, int(max_ai_calls)) * max(1, int(batch_size))
+    asked = sorted(uncertain[:budget])
+    batches = [asked[j:j + max(1, int(batch_size))] for j in range(0, len(asked), max(1, int(batch_size)))]
+
+    stats = {
+        "boundaries": n - 1,
+        "uncertain": len(uncertain),
+        "sent_to_ai": 0,
+        "ai_calls": 0,
+        "ai_errors": [],
+        "ai_unmatched": 0,  # 模型答了、但编号不在本批次或 cut 无法识别的条目（付费但没用上）
+    }
+    decisions: Dict[int, bool] = {}
+    if batches:
+        stats["ai_calls"] = len(batches)
+        stats["sent_to_ai"] = len(asked)
+        with ThreadPoolExecutor(max_workers=min(len(batches), HYBRID_MAX_PARALLEL)) as pool:
+            futures = [pool.submit(_judge_boundaries, sentences, batch, density, window,
+                                   model, api_key, api_url, timeout) for batch in batches]
+            # 按批次顺序收集，失败的批次只记录错误，其边界沿用启发式决定
+            for fut in futures:
                 try:
-                    return json.loads(candidate)
-                except Exception:
-                    return None
-    return None
+                    batch_decisions, unmatched = fut.result()
+                except Exception as e:
+                    stats["ai_errors"].append(str(e)[:200])
+                    continue
+                decisions.update(batch_decisions)
+                stats["ai_unmatched"] += unmatched
+
+    cuts = {i for i in prior if i not in decisions} | {i for i, cut in decisions.items() if cut}
+    stats["ai_decided"] = len(decisions)
+
+    segs = build_segments(sentences, sorted(cuts))
+    return {"segments": segs, "twists": find_twists(sentences), "sentence_count": n, "hybrid": stats}
 
 # ---------------------------
 # Public API
 # ---------------------------
 
+# segment_story 的 hybrid_* 参数 -> hybrid_segment 参数
+HYBRID_KWARGS = {
+    'hybrid_band': 'band',
+    'hybrid_max_calls': 'max_ai_calls',
+    'hybrid_batch_size': 'batch_size',
+    'hybrid_window': 'window',
+}
+
 def segment_story(text: str, density: float = 0.5, mode: str = 'heuristic', ai_provider: str = 'openai', **ai_kwargs) -> Dict[str, Any]:
     """
     主函数：
     - text: 原始故事文本
     - density: 0..1
-    - mode: 'heuristic' 或 'ai'
+    - mode: 'heuristic'、'ai' 或 'hybrid'
     - ai_provider: 目前仅 'openai' 被示例实现
-    - ai_kwargs: 转发给 AI 调用（api_key, model, api_url 等）
+    - ai_kwargs: 转发给 AI 调用（api_key, model, api_url 等）；
+      hybrid 模式另外接受 hybrid_band / hybrid_max_calls / hybrid_batch_size / hybrid_window；
+      stream / on_segment 见 call_ai_api_openai_like，非 ai 模式在分段完成后依次回调 on_segment
     """
     density = max(0.0, min(1.0, float(density)))
-    if mode == 'heuristic':
-        return heuristic_segment(text, density=density)
-    elif mode == 'ai':
+    hybrid_opts = {name: ai_kwargs.pop(key) for key, name in HYBRID_KWARGS.items() if key in ai_kwargs}
+    hybrid_opts = {name: v for name, v in hybrid_opts.items() if v is not None}
+    if mode == 'ai':
         provider = ai_provider.lower()
-        if provider == 'openai':
-            return call_ai_api_openai_like(text=text, density=density, **ai_kwargs)
-        else:
+        if provider != 'openai':
             raise ValueError(f"未知的 ai_provider: {ai_provider}")
+        return call_ai_api_openai_like(text=text, density=density, **ai_kwargs)
+
+    # 仅 ai 模式支持流式；其余模式在完成后依次回调 on_segment
+    on_segment = ai_kwargs.pop('on_segment', None)
+    ai_kwargs.pop('stream', None)
+    if mode == 'heuristic':
+        result = heuristic_segment(text, density=density)
+    elif mode == 'hybrid':
+        if ai_provider.lower() != 'openai':
+            raise ValueError(f"未知的 ai_provider: {ai_provider}")
+        # hybrid 使用自己的边界判定提示词
+        ai_kwargs.pop('prompt_version', None)
+        result = hybrid_segment(text, density=density, **ai_kwargs, **hybrid_opts)
     else:
-        raise ValueError("mode 必须是 'heuristic' 或 'ai'")
+        raise ValueError("mode 必须是 'heuristic'、'ai' 或 'hybrid'")
+    if on_segment is not None:
+        for seg in result.get("segments", []):
+            on_segment(seg)
+    return result
     
 
 def generate_annotated_text(original_text: str, segments: Sequence[dict], marker_template: str = "{{seg {id:03d}}}") -> str:
@@ -392,16 +942,25 @@ def write_output_file(path: str, data: Dict[str, Any]) -> None:
     with open(path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
+def print_segment(seg: Dict[str, Any]) -> None:
+    print(f"[seg] {seg.get('summary', '')}", flush=True)
+
 def main():
     parser = argparse.ArgumentParser(description="将叙事文本拆分为场景/段落/转折点")
     parser.add_argument("input", help="输入文本文件路径（UTF-8）")
     parser.add_argument("--output", "-o", help="输出 JSON 文件路径（默认：input.json）")
-    parser.add_argument("--mode", choices=['heuristic','ai'], default='heuristic', help="使用本地启发式还是 AI")
+    parser.add_argument("--mode", choices=['heuristic','ai','hybrid'], default='heuristic', help="使用本地启发式、AI，或启发式 + AI 判定模糊边界（hybrid）")
     parser.add_argument("--provider", default='openai', help="AI 提供商（ai 模式有效），例如 openai")
     parser.add_argument("--model", default='gpt-4o-mini', help="模型名（ai 模式有效）")
     parser.add_argument("--density", type=float, default=0.5, help="分段密集度 0.0..1.0")
     parser.add_argument("--api_key", default=None, help="API Key（可不传，从环境 AI_API_KEY 读取）")
     parser.add_argument("--api_url", default=None, help="API URL（可选，ai 模式）")
+    parser.add_argument("--prompt_version", choices=list(AI_PROMPT_VERSIONS), default='v1', help="AI 提示词协议：v1 字符偏移，v2 句子编号（更省 token）")
+    parser.add_argument("--stream", action="store_true", help="ai 模式使用流式返回，每确定一段即打印")
+    parser.add_argument("--hybrid_band", type=float, default=None, help="hybrid 模式置信带宽度（默认 0.5），分数线 ±band 内的边界交给模型")
+    parser.add_argument("--hybrid_max_calls", type=int, default=None, help="hybrid 模式每篇文档最多调用模型次数（默认 3）")
+    parser.add_argument("--hybrid_batch_size", type=int, default=None, help="hybrid 模式每次调用判定的边界数（默认 8）")
+    parser.add_argument("--hybrid_window", type=int, default=None, help="hybrid 模式边界前后各带几句上下文（默认 2）")
     args = parser.parse_args()
 
     text = read_input_file(args.input)
@@ -415,7 +974,14 @@ def main():
             ai_provider=args.provider,
             api_key=args.api_key,
             model=args.model,
-            api_url=args.api_url
+            api_url=args.api_url,
+            prompt_version=args.prompt_version,
+            hybrid_band=args.hybrid_band,
+            hybrid_max_calls=args.hybrid_max_calls,
+            hybrid_batch_size=args.hybrid_batch_size,
+            hybrid_window=args.hybrid_window,
+            stream=args.stream,
+            on_segment=print_segment if args.stream else None
         )
     except Exception as e:
         print("处理失败：", e)
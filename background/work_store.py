@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Local SQLite store for analysed works, their segments, twists and image references.
+
+The bridge server persists /analyze and /pipeline results here so the frontend can list
+works and reopen one (or page through its scenes) with indexed reads instead of re-running
+the segmenter.
+
+Tables:
+- works     one row per work; indexed by (updated_at, work_id) for newest-first listing
+- segments  primary key (work_id, seg_index), so a work's scenes are read as an index range
+- twists    primary key (work_id, twist_index)
+
+Usage:
+  store = WorkStore('works.db')
+  work_id = store.save_analysis(text, result, title='...')
+  store.get_work(work_id)
+"""
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS works (
+    work_id        TEXT PRIMARY KEY,
+    title          TEXT NOT NULL DEFAULT '',
+    author         TEXT NOT NULL DEFAULT '',
+    description    TEXT NOT NULL DEFAULT '',
+    original_text  TEXT NOT NULL DEFAULT '',
+    status         TEXT NOT NULL DEFAULT 'analyzed',
+    mode           TEXT,
+    density        REAL,
+    sentence_count INTEGER,
+    segment_count  INTEGER NOT NULL DEFAULT 0,
+    cover_image    TEXT,
+    created_at     TEXT NOT NULL,
+    updated_at     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_works_updated ON works (updated_at DESC, work_id DESC);
+
+CREATE TABLE IF NOT EXISTS segments (
+    work_id        TEXT NOT NULL REFERENCES works (work_id) ON DELETE CASCADE,
+    seg_index      INTEGER NOT NULL,
+    type           TEXT NOT NULL DEFAULT 'scene',
+    start_sentence INTEGER,
+    end_sentence   INTEGER,
+    start_char     INTEGER,
+    end_char       INTEGER,
+    text           TEXT NOT NULL DEFAULT '',
+    summary        TEXT NOT NULL DEFAULT '',
+    cues           TEXT,
+    image          TEXT,
+    PRIMARY KEY (work_id, seg_index)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS twists (
+    work_id        TEXT NOT NULL REFERENCES works (work_id) ON DELETE CASCADE,
+    twist_index    INTEGER NOT NULL,
+    sentence_index INTEGER,
+    char_index     INTEGER,
+    text           TEXT NOT NULL DEFAULT '',
+    cue            TEXT,
+    reason         TEXT,
+    PRIMARY KEY (work_id, twist_index)
+) WITHOUT ROWID;
+"""
+
+# columns returned when listing works (original_text is left out; it can be large)
+WORK_SUMMARY_COLUMNS = ('work_id', 'title', 'author', 'description', 'status', 'mode', 'density',
+                        'sentence_count', 'segment_count', 'cover_image', 'created_at', 'updated_at')
+SEGMENT_COLUMNS = ('seg_index', 'type', 'start_sentence', 'end_sentence', 'start_char', 'end_char',
+                   'text', 'summary', 'cues', 'image')
+
+
+def _now() -> str:
+    # fixed-width ISO timestamps sort correctly as text
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _int_or_none(v: Any) -> Optional[int]:
+    try:
+        return None if v is None else int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class WorkStore:
+    """Thread-safe wrapper around one SQLite file (one connection per thread, WAL journal)."""
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    # ---------- writes ----------
+
+    def save_analysis(self, text: str, result: Dict[str, Any], work_id: Optional[str] = None,
+                      title: Optional[str] = None, author: Optional[str] = None, description: Optional[str] = None,
+                      mode: Optional[str] = None, density: Optional[float] = None,
+                      images: Optional[Dict[int, str]] = None) -> str:
+        """Insert or replace a work's text and analysis. Existing segments and twists are replaced.
+        images maps segment index -> image reference (e.g. 'job_x/scene_000.png').
+        Title/author/description keep their stored values when not given.
+        """
+        work_id = work_id or uuid.uuid4().hex
+        segments = [s for s in (result.get('segments') or []) if isinstance(s, dict)]
+        twists = [t for t in (result.get('twists') or []) if isinstance(t, dict)]
+        images = images or {}
+        now = _now()
+        cover = next((images[i] for i in sorted(images) if images[i]), None)
+
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                """INSERT INTO works (work_id, title, author, description, original_text, status, mode, density,
+                                      sentence_count, segment_count, cover_image, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, 'analyzed', ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (work_id) DO UPDATE SET
+                       title = COALESCE(?, title),
+                       author = COALESCE(?, author),
+                       description = COALESCE(?, description),
+                       original_text = excluded.original_text,
+                       status = excluded.status,
+                       mode = excluded.mode,
+                       density = excluded.density,
+                       sentence_count = excluded.sentence_count,
+                       segment_count = excluded.segment_count,
+                       cover_image = excluded.cover_image,
+                       updated_at = excluded.updated_at""",
+                (work_id, title or '', author or '', description or '', text, mode, density,
+                 _int_or_none(result.get('sentence_count')), len(segments), cover, now, now,
+                 title, author, description))
+            conn.execute('DELETE FROM segments WHERE work_id = ?', (work_id,))
+            conn.execute('DELETE FROM twists WHERE work_id = ?', (work_id,))
+            conn.executemany(
+                'INSERT INTO segments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(work_id, i, s.get('type') or 'scene',
+                  _int_or_none(s.get('start_sentence')), _int_or_none(s.get('end_sentence')),
+                  _int_or_none(s.get('start_char')), _int_or_none(s.get('end_char')),
+                  s.get('text') or '', s.get('summary') or '',
+                  json.dumps(s['cues'], ensure_ascii=False) if s.get('cues') else None,
+                  images.get(i))
+                 for i, s in enumerate(segments)])
+            conn.executemany(
+                'INSERT INTO twists VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(work_id, i, _int_or_none(t.get('sentence_index')), _int_or_none(t.get('char_index')),
+                  t.get('text') or '', t.get('cue'), t.get('reason'))
+                 for i, t in enumerate(twists)])
+        return work_id
+
+    def attach_image(self, work_id: str, seg_index: int, image: str) -> bool:
+        """Record the image for one segment; the first image also becomes the work's cover."""
+        conn = self._conn()
+        with conn:
+            cur = conn.execute('UPDATE segments SET image = ? WHERE work_id = ? AND seg_index = ?',
+                               (image, work_id, int(seg_index)))
+            if cur.rowcount == 0:
+                return False
+            conn.execute('UPDATE works SET cover_image = COALESCE(cover_image, ?), updated_at = ? WHERE work_id = ?',
+                         (image, _now(), work_id))
+        return True
+
+    def delete_work(self, work_id: str) -> bool:
+        conn = self._conn()
+        with conn:
+            cur = conn.execute('DELETE FROM works WHERE work_id = ?', (work_id,))
+        return cur.rowcount > 0
+
+    # ---------- reads ----------
+
+    def list_works(self, limit: int = 20, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Newest-first page of works. Returns (works, next_cursor); next_cursor is None on the last page.
+        Keyset pagination on (updated_at, work_id), so deep pages cost the same as the first.
+        """
+        limit = max(1, min(int(limit), 200))
+        cols = ', '.join(WORK_SUMMARY_COLUMNS)
+        if cursor:
+            updated_at, _, last_id = cursor.partition('|')
+            rows = self._conn().execute(
+                f'SELECT {cols} FROM works WHERE (updated_at, work_id) < (?, ?) '
+                'ORDER BY updated_at DESC, work_id DESC LIMIT ?', (updated_at, last_id, limit + 1)).fetchall()
+        else:
+            rows = self._conn().execute(
+                f'SELECT {cols} FROM works ORDER BY updated_at DESC, work_id DESC LIMIT ?', (limit + 1,)).fetchall()
+        works = [dict(r) for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = works[-1]
+            next_cursor = f"{last['updated_at']}|{last['work_id']}"
+        return works, next_cursor
+
+    def get_work(self, work_id: str, include_text: bool = True) -> Optional[Dict[str, Any]]:
+        cols = ', '.join(WORK_SUMMARY_COLUMNS + (('original_text',) if include_text else ()))
+        row = self._conn().execute(f'SELECT {cols} FROM works WHERE work_id = ?', (work_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_segments(self, work_id: str, start: int = 0, limit: int = 50,
+                     types: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """Segments with seg_index >= start, in order (a range scan of the primary key)."""
+        limit = max(1, min(int(limit), 500))  # keep in sync with server.SEGMENT_PAGE_MAX
+        sql = f"SELECT {', '.join(SEGMENT_COLUMNS)} FROM segments WHERE work_id = ? AND seg_index >= ?"
+        params: List[Any] = [work_id, max(0, int(start))]
+        if types:
+            sql += f" AND type IN ({', '.join('?' for _ in types)})"
+            params += list(types)
+        sql += ' ORDER BY seg_index LIMIT ?'
+        params.append(limit)
+        out = []
+        for row in self._conn().execute(sql, params):
+            seg = dict(row)
+            seg['cues'] = json.loads(seg['cues']) if seg['cues'] else []
+            out.append(seg)
+        return out
+
+    def get_twists(self, work_id: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            'SELECT sentence_index, char_index, text, cue, reason FROM twists WHERE work_id = ? ORDER BY twist_index',
+            (work_id,))
+        return [{k: v for k, v in dict(r).items() if v is not None} for r in rows]